@@ -1,16 +1,117 @@
+import logging
 import os
-from google import genai
-from google.genai import types
+import threading
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
-import tkinter as tk
-from tkinter import filedialog
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Caché de contexto de Gemini para el prefijo estático del análisis.
+# La caché exige un modelo con versión fija.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+CACHE_MODEL = "gemini-2.0-flash-001"
+CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+# Tamaño mínimo de una caché explícita para CACHE_MODEL. El prefijo actual
+# (~1.000 tokens) no llega: la caché queda desactivada sin llamar a la API
+# hasta que el prefijo crezca (p. ej. con más ejemplos).
+CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "32768"))
+
+# `google.genai` y `tkinter` son costosos de importar (y Tk puede no estar
+# disponible en el servidor), así que se cargan solo cuando se usan.
+
+
+@lru_cache(maxsize=1)
+def get_client():
+    """Construye el cliente de Gemini la primera vez que se necesita."""
+    from google import genai
+    from google.genai import types
+
+    # GEMINI_BASE_URL permite apuntar a un servidor local que imite la API (pruebas, benchmarks).
+    base_url = os.getenv("GEMINI_BASE_URL")
+    return genai.Client(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        http_options=types.HttpOptions(base_url=base_url) if base_url else None,
+    )
+
+
+class PromptCache:
+    """
+    Mantiene registrado en Gemini el prefijo estático como caché de contexto.
+
+    - Se crea en el primer uso y se renueva (TTL) cuando está por expirar.
+    - Si no se puede crear, `get_name` devuelve None y las peticiones envían el
+      prefijo completo. Un prefijo por debajo de CACHE_MIN_TOKENS o un 400
+      deshabilitan la caché en este proceso; otros errores solo durante
+      `retry_after` segundos.
+    """
+
+    def __init__(self, ttl: int = CACHE_TTL_SECONDS, renew_margin: int = 300, retry_after: int = 600):
+        self.ttl = ttl
+        self.renew_margin = min(renew_margin, ttl // 2)
+        self.retry_after = retry_after
+        self._name = None
+        self._expires_at = 0.0
+        self._disabled_until = 0.0
+        self._lock = threading.Lock()
+
+    def get_name(self, client):
+        from google.genai import errors, types
+
+        with self._lock:
+            now = time.time()
+            if now < self._disabled_until:
+                return None
+            if not self._name and tokens_estaticos() < CACHE_MIN_TOKENS:
+                logger.info(f"El prefijo estático (~{tokens_estaticos()} tokens) no llega al mínimo de la caché "
+                            f"de contexto ({CACHE_MIN_TOKENS}); se envía el prompt completo.")
+                self._disabled_until = float("inf")
+                return None
+            if self._name and now < self._expires_at - self.renew_margin:
+                return self._name
+            if self._name and now < self._expires_at:
+                try:
+                    client.caches.update(
+                        name=self._name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+                    )
+                    self._expires_at = now + self.ttl
+                    return self._name
+                except Exception as e:
+                    logger.warning(f"No se pudo renovar la caché de contexto: {str(e)}")
+            try:
+                cache = client.caches.create(
+                    model=CACHE_MODEL,
+                    config=types.CreateCachedContentConfig(
+                        contents=contenido_estatico(),
+                        display_name="analisis-examenes",
+                        ttl=f"{self.ttl}s",
+                    ),
+                )
+                self._name, self._expires_at = cache.name, now + self.ttl
+                return self._name
+            except Exception as e:
+                logger.warning(f"Caché de contexto no disponible, se envía el prompt completo: {str(e)}")
+                self._name = None
+                permanente = isinstance(e, errors.ClientError) and e.code == 400
+                self._disabled_until = float("inf") if permanente else now + self.retry_after
+                return None
+
+    def invalidate(self, name: str):
+        with self._lock:
+            if self._name == name:
+                self._name = None
+
+
+prompt_cache = PromptCache()
 
 
 def seleccionar_pdf():
     """Abre una ventana para seleccionar el archivo PDF"""
+    import tkinter as tk
+    from tkinter import filedialog
+
     root = tk.Tk()
     root.withdraw()
     archivo = filedialog.askopenfilename(
@@ -19,31 +120,14 @@ def seleccionar_pdf():
     )
     return archivo
 
-def generate(file_upload):
-    client = genai.Client(
-        api_key=os.getenv("GEMINI_API_KEY"),
-    )
-
-        # 1. Seleccionar y subir el PDF
-    pdf_path = file_upload
-    if not pdf_path:
-        print("No se seleccionó ningún archivo")
-        return
-    
-    if not os.path.exists(pdf_path):
-        print(f"Error: El archivo {pdf_path} no existe")
-        return
-
-    try:
-        uploaded_file = client.files.upload(file=pdf_path)
-    except Exception as e:
-        print(f"Error al subir el archivo: {str(e)}")
-        return
+def contenido_estatico():
+    """
+    Instrucciones y respuesta de ejemplo que preceden a cada documento. Son
+    iguales en todas las peticiones, por eso se registran como caché de contexto.
+    """
+    from google.genai import types
 
-
-
-    model = "gemini-2.0-flash"
-    contents = [
+    return [
         types.Content(
             role="user",
             parts=[
@@ -113,18 +197,48 @@ Espero tu documento.
 """),
             ],
         ),
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_uri(
-                    file_uri=uploaded_file.uri,
-                    mime_type=uploaded_file.mime_type,
-                ),
-                types.Part.from_text(text="""examen"""),
-            ],
-        ),
     ]
-    generate_content_config = types.GenerateContentConfig(
+
+@lru_cache(maxsize=1)
+def tokens_estaticos() -> int:
+    """Estimación de los tokens del prefijo estático (~4 caracteres por token)."""
+    return sum(len(part.text) for content in contenido_estatico() for part in content.parts) // 4 + 1
+
+def generate(file_upload):
+    from google.genai import errors, types
+
+    client = get_client()
+
+        # 1. Seleccionar y subir el PDF
+    pdf_path = file_upload
+    if not pdf_path:
+        print("No se seleccionó ningún archivo")
+        return
+    
+    if not os.path.exists(pdf_path):
+        print(f"Error: El archivo {pdf_path} no existe")
+        return
+
+    try:
+        uploaded_file = client.files.upload(file=pdf_path)
+    except Exception as e:
+        print(f"Error al subir el archivo: {str(e)}")
+        return
+
+
+
+    model = "gemini-2.0-flash"
+    documento = types.Content(
+        role="user",
+        parts=[
+            types.Part.from_uri(
+                file_uri=uploaded_file.uri,
+                mime_type=uploaded_file.mime_type,
+            ),
+            types.Part.from_text(text="""examen"""),
+        ],
+    )
+    config = dict(
         temperature=1,
         top_p=0.95,
         top_k=40,
@@ -132,10 +246,33 @@ Espero tu documento.
         response_mime_type="text/plain",
     )
 
+    # Con caché solo se envía el documento; las instrucciones ya están en Gemini.
+    # Si la caché expiró o fue borrada, se recrea una vez y se reintenta.
+    for _ in range(2):
+        cache_name = prompt_cache.get_name(client) if CONTEXT_CACHE_ENABLED else None
+        if cache_name is None:
+            break
+        try:
+            response = client.models.generate_content(
+                model=CACHE_MODEL,
+                contents=[documento],
+                config=types.GenerateContentConfig(cached_content=cache_name, **config)
+            )
+            return response.text
+        except errors.ClientError as e:
+            if e.code not in (403, 404):
+                raise
+            logger.info(f"La caché de contexto {cache_name} ya no está disponible; se recreará.")
+            prompt_cache.invalidate(cache_name)
+
+    # Sin caché: el prefijo estático se envía completo, como siempre.
+    contents = contenido_estatico() + [documento]
+    generate_content_config = types.GenerateContentConfig(**config)
+
     response = client.models.generate_content(
         model=model,
         contents=contents,
         config=generate_content_config
     )
 
-    return response.text 
+    return response.text
@@ -0,0 +1,174 @@
+"""
+Renderizador incremental del Markdown que devuelve el modelo a HTML seguro.
+
+Soporta el subconjunto que usa Gemini en los análisis: negritas, cursivas,
+código en línea, encabezados, viñetas y listas numeradas (con anidación por
+sangría), tablas y separadores. Todo el texto se escapa, así que el resultado
+se puede insertar en la plantilla con `| safe`.
+
+Es una máquina de estados que procesa el texto línea por línea y admite
+fragmentos incrementales: `feed()` devuelve el HTML de las líneas completas
+recibidas y `close()` el resto. El estado entre líneas son las listas abiertas
+y la tabla en curso.
+"""
+import html
+import re
+
+_TITULO_RE = re.compile(r"^[ \t]*(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$")
+_ITEM_RE = re.compile(r"^([ \t]*)(?:[*+•-]|(\d+)[.)])[ \t]+(.*)$")
+_REGLA_RE = re.compile(r"^[ \t]*([-*_])(?:[ \t]*\1){2,}[ \t]*$")
+_TABLE_SEPARATOR_RE = re.compile(r"^[ \t]*\|?[ \t]*:?-+:?[ \t]*(\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*$")
+# Caracteres con los que puede empezar una línea que no es un párrafo. El resto
+# de las líneas (la mayoría en prosa) no se comparan con ninguna expresión.
+_INICIOS_DE_BLOQUE = frozenset(" \t|#*+•-_0123456789")
+
+# El formato en línea nunca cruza un salto de línea, así que se puede aplicar
+# al bloque completo. Un `*` pegado a una palabra (2*3) no abre cursiva.
+_CODE_RE = re.compile(r"`([^`\n]+)`")
+_BOLD_RE = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*")
+_ITALIC_RE = re.compile(r"\*(?<![\w*]\*)(?=[^\s*])([^*\n]+?)(?<=\S)\*(?![\w*])")
+
+
+def _envolver(patron, texto: str, apertura: str, cierre: str) -> str:
+    # split + join en lugar de sub con plantilla: evita expandir la plantilla
+    # en cada coincidencia.
+    partes = patron.split(texto)
+    if len(partes) > 1:
+        partes[1::2] = [apertura + p + cierre for p in partes[1::2]]
+        texto = "".join(partes)
+    return texto
+
+
+def _inline(texto: str) -> str:
+    """Escapa el texto y convierte `código`, **negrita** y *cursiva*."""
+    # El texto nunca termina dentro de un atributo, así que basta con escapar &, < y >.
+    texto = html.escape(texto, quote=False)
+    if "`" in texto:
+        texto = _envolver(_CODE_RE, texto, "<code>", "</code>")
+    if "*" in texto:
+        texto = _envolver(_BOLD_RE, texto, "<strong>", "</strong>")
+        texto = _envolver(_ITALIC_RE, texto, "<em>", "</em>")
+    return texto
+
+
+def _fila(linea: str, etiqueta: str) -> str:
+    """Convierte una fila de tabla en <tr>."""
+    celdas = [celda.strip() for celda in linea.strip().strip("|").split("|")]
+    return f"<tr><{etiqueta}>" + f"</{etiqueta}><{etiqueta}>".join(celdas) + f"</{etiqueta}></tr>"
+
+
+class MarkdownRenderer:
+    """Convierte Markdown a HTML a medida que llegan los fragmentos."""
+
+    def __init__(self):
+        self._pendiente = ""
+        # Listas abiertas: (etiqueta, sangría). El último <li> queda abierto.
+        self._listas = []
+        self._en_tabla = False
+        # Primera fila de la tabla: es la cabecera si la siguiente es un separador.
+        self._cabecera = None
+        self._cuerpo_abierto = False
+
+    def feed(self, fragmento: str) -> str:
+        texto = self._pendiente + fragmento
+        corte = texto.rfind("\n")
+        if corte == -1:
+            self._pendiente = texto
+            return ""
+        self._pendiente = texto[corte + 1:]
+        return self._bloque(texto[:corte])
+
+    def close(self) -> str:
+        salida = self._bloque(self._pendiente) if self._pendiente else ""
+        self._pendiente = ""
+        return salida + self._cerrar_tabla() + self._cerrar_listas()
+
+    def _bloque(self, texto: str) -> str:
+        return "".join([self._linea(linea) for linea in _inline(texto).split("\n")])
+
+    def _linea(self, linea: str) -> str:
+        """Procesa una línea completa (ya escapada y con el formato en línea)."""
+        if linea and linea[0] not in _INICIOS_DE_BLOQUE:
+            return self._cerrar_tabla() + self._cerrar_listas() + f"<p>{linea}</p>"
+        if linea.lstrip().startswith("|"):
+            return self._fila_tabla(linea)
+        # Cualquier otra línea, también una en blanco, termina la tabla.
+        salida = self._cerrar_tabla()
+        if not linea.strip():
+            # Una línea en blanco no cierra la lista: puede haberla entre elementos.
+            return salida
+
+        if _REGLA_RE.match(linea):
+            return salida + self._cerrar_listas() + "<hr>"
+        titulo = _TITULO_RE.match(linea)
+        if titulo:
+            etiqueta = "h3" if len(titulo.group(1)) <= 2 else "h4"
+            return salida + self._cerrar_listas() + f"<{etiqueta}>{titulo.group(2)}</{etiqueta}>"
+        item = _ITEM_RE.match(linea)
+        if item:
+            sangria, numero, texto = item.groups()
+            return salida + self._item("ol" if numero else "ul", len(sangria), texto, numero)
+
+        contenido = linea.lstrip(" \t")
+        if self._listas and contenido != linea:
+            # Continuación con sangría de un elemento de lista.
+            return salida + f"<br>{contenido}"
+        return salida + self._cerrar_listas() + f"<p>{contenido}</p>"
+
+    # --- Listas ---
+
+    def _cerrar_listas(self, hasta_sangria: int = -1) -> str:
+        salida = ""
+        while self._listas and self._listas[-1][1] > hasta_sangria:
+            salida += f"</li></{self._listas.pop()[0]}>"
+        return salida
+
+    def _item(self, etiqueta: str, sangria: int, texto: str, numero: str = None) -> str:
+        salida = self._cerrar_listas(hasta_sangria=sangria)
+        if self._listas and self._listas[-1][1] == sangria:
+            if self._listas[-1][0] == etiqueta:
+                return salida + f"</li><li>{texto}"
+            # Misma sangría pero otro tipo de lista: se cierra la anterior.
+            salida += self._cerrar_listas(hasta_sangria=sangria - 1)
+        inicio = f' start="{int(numero)}"' if numero and int(numero) != 1 else ""
+        self._listas.append((etiqueta, sangria))
+        return salida + f"<{etiqueta}{inicio}><li>{texto}"
+
+    # --- Tablas ---
+
+    def _fila_tabla(self, linea: str) -> str:
+        if not self._en_tabla:
+            # La primera fila puede ser la cabecera: se decide con la siguiente.
+            self._en_tabla, self._cabecera = True, linea
+            return self._cerrar_listas() + '<table class="table table-sm">'
+        salida = ""
+        if self._cabecera is not None:
+            cabecera, self._cabecera = self._cabecera, None
+            if _TABLE_SEPARATOR_RE.match(linea):
+                return "<thead>" + _fila(cabecera, "th") + "</thead>"
+            salida = self._abrir_cuerpo() + _fila(cabecera, "td")
+        return salida + self._abrir_cuerpo() + _fila(linea, "td")
+
+    def _abrir_cuerpo(self) -> str:
+        if self._cuerpo_abierto:
+            return ""
+        self._cuerpo_abierto = True
+        return "<tbody>"
+
+    def _cerrar_tabla(self) -> str:
+        if not self._en_tabla:
+            return ""
+        salida = ""
+        if self._cabecera is not None:
+            # Una tabla de una sola fila sin separador: la fila va al cuerpo.
+            salida += self._abrir_cuerpo() + _fila(self._cabecera, "td")
+        if self._cuerpo_abierto:
+            salida += "</tbody>"
+        self._en_tabla, self._cabecera, self._cuerpo_abierto = False, None, False
+        return salida + "</table>"
+
+
+def render_markdown(texto: str) -> str:
+    """Renderiza un texto completo."""
+    renderer = MarkdownRenderer()
+    return renderer.feed(texto) + renderer.close()
@@ -17,8 +17,27 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def create_report_for_user(db: Session, report: schemas.ReportCreate, user_id: int, file_hash: str):
-    db_report = models.Report(report_content=report.report_content, user_id=user_id, file_hash=file_hash)
+def get_users_with_reports(db: Session):
+    return db.query(models.User).filter(models.User.reports.any()).order_by(models.User.id).all()
+
+def get_report_by_id(db: Session, report_id: int):
+    return db.query(models.Report).filter(models.Report.id == report_id).first()
+
+def get_report_signatures_after(db: Session, user_id: int, after_id: int):
+    return (
+        db.query(models.Report.id, models.Report.minhash)
+        .filter(models.Report.user_id == user_id, models.Report.id > after_id, models.Report.minhash.isnot(None))
+        .order_by(models.Report.id)
+        .all()
+    )
+
+def create_report_for_user(db: Session, report: schemas.ReportCreate, user_id: int, file_hash: str, source_pdf: bytes = None,
+                           minhash: bytes = None, duplicate_of_id: int = None, summary_embedding=None):
+    db_report = models.Report(report_content=report.report_content, user_id=user_id, file_hash=file_hash,
+                              minhash=minhash, duplicate_of_id=duplicate_of_id,
+                              summary_embedding=summary_embedding)
+    if source_pdf is not None:
+        db_report.source = models.ReportSource(content=source_pdf)
     db.add(db_report)
     db.commit()
     db.refresh(db_report)
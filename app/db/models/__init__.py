@@ -1,2 +1,2 @@
 # Initialize module
-from .models import User, Report
\ No newline at end of file
+from .models import User, Report, ReportSource
\ No newline at end of file
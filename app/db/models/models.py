@@ -1,7 +1,32 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, func, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, LargeBinary, func, UniqueConstraint
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import UserDefinedType
 from app.db.database import Base
 
+class Vector(UserDefinedType):
+    """
+    Columna `vector(dim)` de pgvector. Se declara aquí en lugar de usar
+    pgvector.sqlalchemy, que importa numpy al cargarse (y los modelos se cargan
+    al importar app.main). Se lee y escribe como lista de floats.
+    """
+    cache_ok = True
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"VECTOR({self.dim})"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            return None if value is None else "[" + ",".join(str(float(x)) for x in value) + "]"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            return None if value is None else [float(x) for x in value[1:-1].split(",")]
+        return process
+
 class User(Base):
     __tablename__ = "users"
 
@@ -19,8 +44,25 @@ class Report(Base):
     file_hash = Column(String, index=True, nullable=False)
     report_content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Firma MinHash del texto del PDF, para detectar casi duplicados
+    minhash = Column(LargeBinary, nullable=True)
+    # Reporte del que este es casi duplicado (si se detectó al subirlo)
+    duplicate_of_id = Column(Integer, ForeignKey("reports.id", ondelete="SET NULL"), nullable=True)
+    # Embedding del análisis, para elegir qué reportes consultar en el informe general
+    summary_embedding = Column(Vector(768), nullable=True)
     
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     user = relationship("User", back_populates="reports")
+    source = relationship("ReportSource", back_populates="report", uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (UniqueConstraint('user_id', 'file_hash', name='_user_file_hash_uc'),)
+
+class ReportSource(Base):
+    """PDF original de un reporte, conservado para poder reindexarlo."""
+    __tablename__ = "report_sources"
+
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    __table_args__ = (UniqueConstraint('user_id', 'file_hash', name='_user_file_hash_uc'),) 
\ No newline at end of file
+    report = relationship("Report", back_populates="source") 
\ No newline at end of file
@@ -13,6 +13,7 @@ class Report(ReportBase):
     user_id: int
     created_at: datetime
     file_hash: str
+    duplicate_of_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -1,28 +1,55 @@
-from fastapi import FastAPI, Request, File, UploadFile, HTTPException, Depends, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, File, UploadFile, HTTPException, Depends, Body, Path
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 import tempfile
 import os
 from app.api.utils.ia import generate
-import html
-import re
+from app.api.utils.markdown import render_markdown
 import uuid
 import hashlib
 import asyncio
+import logging
+import time
+from typing import List
+from contextlib import asynccontextmanager
 
 from . import crud, rag_service
 from .db import database, schemas
 from .db.models import models
+from .services import near_duplicates, pdf_export
+from .services.single_flight import LiderCancelado, SingleFlight, advisory_lock, lock_key
 
-models.Base.metadata.create_all(bind=database.engine)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # La creación del esquema se hace al arrancar y no al importar el módulo,
+    # para que importar la app no requiera una base de datos disponible.
+    await asyncio.to_thread(models.Base.metadata.create_all, bind=database.engine)
+    # También la columna de búsqueda léxica, para que las primeras subidas no
+    # pidan una segunda conexión del pool mientras retienen la de su sesión.
+    from .services.hybrid_search import ensure_search_schema
+    await asyncio.to_thread(ensure_search_schema, database.engine)
+    yield
+    pdf_export.shutdown()
 
 # Instancia de FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Temporary storage for results (key: unique ID, value: result data)
 results_store = {}
 
+# Subidas en curso por (user_id, file_hash), para coalescer duplicados concurrentes
+uploads_en_curso = SingleFlight()
+
+# Cada subida retiene una conexión del pool (size 5 + overflow 10) durante todo
+# su análisis, por el advisory lock. Las que superan el límite esperan aquí, sin
+# bloquear el event loop, en lugar de esperar a una conexión dentro de él.
+MAX_CONCURRENT_UPLOADS = int(os.getenv("MAX_CONCURRENT_UPLOADS", "8"))
+subidas_simultaneas = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+
 # Configuración de Jinja2 para las plantillas
 templates = Jinja2Templates(directory="app/templates")
 
@@ -34,21 +61,6 @@ def get_db():
     finally:
         db.close()
 
-def formatear_mensaje(mensaje: str) -> str:
-    # Escapa caracteres especiales
-    mensaje_escapado = html.escape(mensaje)
-    # Reemplaza doble asteriscos (**texto**) por <strong>texto</strong>
-    mensaje_destacado = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', mensaje_escapado)
-    # Reemplaza líneas que empiecen con "* " por viñetas
-    # (ej.: "* elemento" -> "• elemento")
-    mensaje_con_vinetas = re.sub(r'^\*\s+(.*)$', r'• \1', mensaje_destacado, flags=re.MULTILINE)
-    # Reemplaza saltos de línea con <br>
-    mensaje_formateado = mensaje_con_vinetas.replace("\n", "<br>")
-    return mensaje_formateado
-
-def quitar_asteriscos(mensaje: str) -> str:
-    return mensaje.replace("*", "•")
-
 # Ruta para la página principal
 @app.get("/")
 async def home(request: Request):
@@ -61,7 +73,7 @@ async def check_user(cedula: str = Body(..., embed=True), db: Session = Depends(
         return {"exists": True, "user": {"full_name": db_user.full_name, "cedula": db_user.cedula}}
     return {"exists": False}
 
-@app.post("/get-reports/")
+@app.post("/get-reports/", response_model=List[schemas.Report])
 async def get_reports(cedula: str = Body(..., embed=True), db: Session = Depends(get_db)):
     db_user = crud.get_user_by_cedula(db, cedula=cedula)
     if not db_user:
@@ -76,14 +88,65 @@ async def generate_report_endpoint(cedula: str = Body(..., embed=True), db: Sess
     if not db_user:
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
+    user_id, subtitulo = db_user.id, _subtitulo_pdf(db_user)
+    # La generación tarda segundos y abre sus propias conexiones: se devuelve la
+    # de esta sesión al pool para no retener dos por petición.
+    db.close()
+
     try:
-        general_report_raw = await rag_service.generate_general_report(db_user.id)
-        general_report_formatted = formatear_mensaje(general_report_raw)
-        return {"report": general_report_formatted}
+        general_report_raw = await rag_service.generate_general_report(user_id)
+        general_report_formatted = render_markdown(general_report_raw)
+        # Se guarda el HTML para poder exportar exactamente este informe a PDF.
+        version = await asyncio.to_thread(
+            pdf_export.guardar_fuente, "informe-general", user_id, general_report_formatted,
+            "Informe General Consolidado", subtitulo
+        )
+        return {
+            "report": general_report_formatted,
+            "pdf_url": f"/informe-general/{user_id}/{version}/pdf"
+        }
     except Exception as e:
         # Podríamos tener un log aquí
         raise HTTPException(status_code=500, detail=f"No se pudo generar el informe general: {str(e)}")
 
+def _subtitulo_pdf(user, fecha=None) -> str:
+    subtitulo = f"{user.full_name} · C.I. {user.cedula}"
+    return f"{subtitulo} · {fecha:%d/%m/%Y}" if fecha else subtitulo
+
+async def _exportar_pdf(request: Request, tipo: str, objeto_id: int, contenido_html: str, titulo: str,
+                       subtitulo: str, nombre: str, cache_control: str):
+    """
+    Sirve el PDF de un documento con su versión como ETag. Si el cliente ya
+    tiene esa versión responde 304 sin renderizar; FileResponse admite Range.
+    """
+    etag = f'"{pdf_export.version(contenido_html, titulo, subtitulo)}"'
+    headers = {"etag": etag, "cache-control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [e.strip() for e in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        ruta, _ = await pdf_export.export_pdf(tipo, objeto_id, contenido_html, titulo, subtitulo)
+    except LiderCancelado:
+        # Se canceló dos veces la petición que estaba renderizando este PDF.
+        raise HTTPException(status_code=503, detail="La exportación del PDF se interrumpió. Por favor, intente de nuevo.")
+    return FileResponse(
+        ruta, media_type="application/pdf", filename=nombre,
+        content_disposition_type="inline", headers=headers
+    )
+
+@app.get("/informe-general/{user_id}/{version}/pdf", summary="Exporta a PDF un informe general ya generado")
+async def informe_general_pdf(request: Request, user_id: int, version: str = Path(..., pattern=r"^[0-9a-f]{16}$")):
+    fuente = await asyncio.to_thread(pdf_export.cargar_fuente, "informe-general", user_id, version)
+    if fuente is None:
+        raise HTTPException(status_code=404, detail="Informe no encontrado. Genera el informe general de nuevo.")
+
+    # La URL incluye la versión: el contenido de esta URL nunca cambia.
+    return await _exportar_pdf(
+        request, "informe-general", user_id, fuente["html"], fuente["titulo"], fuente["subtitulo"],
+        "informe-general.pdf", "private, max-age=31536000, immutable"
+    )
+
 @app.post("/delete-report/")
 async def delete_report(report_id: int = Body(..., embed=True), db: Session = Depends(get_db)):
     success = crud.delete_report_by_id(db, report_id=report_id)
@@ -99,28 +162,11 @@ async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db))
     new_user = crud.create_user(db=db, user=user)
     return new_user
 
-# Ruta para procesar el archivo PDF
-@app.post("/medical-report/")
-async def medical_report(file: UploadFile = File(...), cedula: str = Body(...), db: Session = Depends(get_db)):
-    # Validar tipo de archivo
-    if not file.filename.endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
-    
-    db_user = crud.get_user_by_cedula(db, cedula=cedula)
-    if not db_user:
-        raise HTTPException(status_code=404, detail="Usuario no encontrado")
-
+async def _procesar_reporte(db: Session, user_id: int, file_hash: str, content: bytes,
+                            minhash: bytes = None, duplicate_of_id: int = None) -> int:
+    """Pipeline completo de un PDF (embeddings + análisis con Gemini). Devuelve el id del reporte."""
     tmp_path = None
     try:
-        content = await file.read()
-        # Calcular hash del archivo
-        file_hash = hashlib.sha256(content).hexdigest()
-
-        # Verificar si el archivo ya fue subido por este usuario
-        existing_report = crud.get_report_by_hash_for_user(db, user_id=db_user.id, file_hash=file_hash)
-        if existing_report:
-            raise HTTPException(status_code=400, detail="Este archivo ya ha sido analizado anteriormente.")
-
         # Crear archivo temporal
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
             tmp_file.write(content)
@@ -131,38 +177,169 @@ async def medical_report(file: UploadFile = File(...), cedula: str = Body(...),
         # para no bloquear el servidor.
         await asyncio.to_thread(
             rag_service.add_pdf_to_vector_store_sync, 
-            user_id=db_user.id, 
-            file_path=tmp_path
+            user_id=user_id, 
+            file_path=tmp_path,
+            file_hash=file_hash
         )
             
-        result_2 = generate(tmp_path)
+        # También en un hilo: mientras Gemini responde, el servidor sigue
+        # atendiendo (entre otras, a las peticiones que esperan este resultado).
+        result_2 = await asyncio.to_thread(generate, tmp_path)
 
         # Verificar si la IA determinó que no es un examen médico
         invalid_doc_message = "Por favor, sube un documento válido"
         if result_2.strip().startswith(invalid_doc_message):
-            os.unlink(tmp_path) # Limpiar el archivo temporal
             raise HTTPException(status_code=400, detail="El archivo subido no parece ser un examen médico. Por favor, intente con otro documento.")
 
-        result_1 = formatear_mensaje(result_2)
-        result = quitar_asteriscos(result_1)
-        
+        result = render_markdown(result_2)
+
+        # Embedding del análisis, para que el informe general elija en qué
+        # reportes buscar. Solo lo usa REPORT_RANKING=relevance: con "recency" no
+        # se paga esa llamada. Si falta (o falla) no se pierde la subida: lo
+        # completa `python -m app.reindex --summaries-only`.
+        summary_embedding = None
+        if rag_service.REPORT_RANKING == "relevance":
+            try:
+                summary_embedding = await asyncio.to_thread(rag_service.embed_report_summary, result)
+            except Exception as e:
+                logger.warning(f"No se pudo calcular el embedding del análisis del usuario {user_id}: {e}")
+
         # Guardar el reporte en la base de datos
         db_report = crud.create_report_for_user(
             db=db, 
             report=schemas.ReportCreate(report_content=result), 
-            user_id=db_user.id,
-            file_hash=file_hash
+            user_id=user_id,
+            file_hash=file_hash,
+            # Se conserva el PDF original para poder reindexarlo (python -m app.reindex)
+            source_pdf=content,
+            minhash=minhash,
+            duplicate_of_id=duplicate_of_id,
+            summary_embedding=summary_embedding
         )
+        return db_report.id
 
-        os.unlink(tmp_path)
-        
-        # Return redirect URL with report ID
-        return JSONResponse({"redirect_url": f"/resultados/{db_report.id}"})
-        
+    except HTTPException:
+        raise
     except Exception as e:
+        raise HTTPException(status_code=500, detail="Error al procesar el archivo")
+    finally:
         if tmp_path and os.path.exists(tmp_path):
             os.unlink(tmp_path)
-        raise HTTPException(status_code=500, detail="Error al procesar el archivo")
+
+def _buscar_casi_duplicado(db: Session, user_id: int, texto: str, firma):
+    """
+    Busca un reporte del usuario con contenido casi idéntico.
+    Devuelve (reporte_original, acción) o (None, None) si no hay ninguno.
+    """
+    if firma is None:
+        return None, None
+
+    near_duplicates.index.sync(
+        user_id, lambda uid, after_id: crud.get_report_signatures_after(db, user_id=uid, after_id=after_id)
+    )
+    inicio = time.perf_counter()
+    encontrado = near_duplicates.index.query(user_id, firma, near_duplicates.THRESHOLD)
+    logger.debug(f"Consulta de casi duplicados: {(time.perf_counter() - inicio) * 1000:.3f} ms")
+    if not encontrado:
+        return None, None
+
+    report_id, similitud = encontrado
+    original = crud.get_report_by_id(db, report_id=report_id)
+    if original is None:
+        # El reporte se borró después de indexarlo
+        near_duplicates.index.remove(user_id, report_id)
+        return None, None
+
+    accion = near_duplicates.ACTION
+    if accion in ("skip", "link"):
+        # Solo se reutiliza el análisis si los valores son exactamente los mismos.
+        texto_original = near_duplicates.extract_text(original.source.content) if original.source else None
+        if texto_original is None or not near_duplicates.mismos_valores(texto, texto_original):
+            accion = "flag"
+    logger.info(f"Casi duplicado del reporte {original.id} (similitud {similitud:.2f}) para el usuario {user_id}: {accion}")
+    return original, accion
+
+async def _procesar_reporte_una_vez(db: Session, user_id: int, file_hash: str, content: bytes) -> int:
+    """
+    Ejecuta el pipeline bajo un advisory lock de (user_id, file_hash), de modo
+    que un mismo archivo nunca se procesa dos veces a la vez, ni en otro worker.
+    """
+    async with advisory_lock(db, user_id, lock_key(file_hash)):
+        # Si otro worker procesó el mismo archivo mientras esperábamos el lock,
+        # se comparte su resultado.
+        existing_report = crud.get_report_by_hash_for_user(db, user_id=user_id, file_hash=file_hash)
+        if existing_report:
+            return existing_report.id
+
+        try:
+            texto = await asyncio.to_thread(near_duplicates.extract_text, content)
+        except Exception:
+            texto = ""
+        firma = near_duplicates.minhash(texto)
+        # En un hilo: puede extraer el texto del PDF del original.
+        original, accion = await asyncio.to_thread(_buscar_casi_duplicado, db, user_id, texto, firma)
+        minhash = near_duplicates.to_bytes(firma) if firma is not None else None
+
+        if accion == "skip":
+            return original.id
+        if accion == "link":
+            # Mismo contenido que un reporte ya analizado: se reutiliza su análisis
+            # sin llamar a Gemini ni añadir chunks repetidos a la colección.
+            db_report = crud.create_report_for_user(
+                db=db,
+                report=schemas.ReportCreate(report_content=original.report_content),
+                user_id=user_id,
+                file_hash=file_hash,
+                source_pdf=content,
+                minhash=minhash,
+                duplicate_of_id=original.id,
+                summary_embedding=original.summary_embedding
+            )
+            report_id = db_report.id
+        else:
+            report_id = await _procesar_reporte(
+                db, user_id, file_hash, content,
+                minhash=minhash, duplicate_of_id=original.id if original else None
+            )
+
+        if firma is not None:
+            near_duplicates.index.add(user_id, report_id, firma)
+        return report_id
+
+# Ruta para procesar el archivo PDF
+@app.post("/medical-report/")
+async def medical_report(file: UploadFile = File(...), cedula: str = Body(...), db: Session = Depends(get_db)):
+    # Validar tipo de archivo
+    if not file.filename.endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Solo se aceptan archivos PDF")
+    
+    async with subidas_simultaneas:
+        db_user = crud.get_user_by_cedula(db, cedula=cedula)
+        if not db_user:
+            raise HTTPException(status_code=404, detail="Usuario no encontrado")
+
+        content = await file.read()
+        # Calcular hash del archivo
+        file_hash = hashlib.sha256(content).hexdigest()
+
+        # Verificar si el archivo ya fue subido por este usuario
+        existing_report = crud.get_report_by_hash_for_user(db, user_id=db_user.id, file_hash=file_hash)
+        if existing_report:
+            raise HTTPException(status_code=400, detail="Este archivo ya ha sido analizado anteriormente.")
+
+        # Subidas simultáneas del mismo archivo (doble clic, reintentos) comparten
+        # un único procesamiento: las demás esperan y reciben el mismo reporte.
+        try:
+            report_id, _ = await uploads_en_curso.do(
+                (db_user.id, file_hash),
+                lambda: _procesar_reporte_una_vez(db, db_user.id, file_hash, content),
+            )
+        except LiderCancelado:
+            # La subida que lo estaba procesando se interrumpió (su cliente se desconectó).
+            raise HTTPException(status_code=503, detail="El procesamiento del archivo se interrumpió. Por favor, intente de nuevo.")
+
+        # Return redirect URL with report ID
+        return JSONResponse({"redirect_url": f"/resultados/{report_id}"})
 
 # New route to fetch results by ID
 @app.get("/resultados/{report_id}")
@@ -173,10 +350,24 @@ async def resultados(request: Request, report_id: int, db: Session = Depends(get
     
     return templates.TemplateResponse("resultados.html", {
         "request": request,
+        "report_id": db_report.id,
         "resultado": db_report.report_content,
         "user_cedula": db_report.user.cedula
     })
 
+@app.get("/resultados/{report_id}/pdf")
+async def resultados_pdf(request: Request, report_id: int, db: Session = Depends(get_db)):
+    db_report = crud.get_report_by_id(db, report_id=report_id)
+    if db_report is None:
+        raise HTTPException(status_code=404, detail="Resultado no encontrado")
+
+    # Misma URL para cualquier versión: el cliente revalida con If-None-Match.
+    return await _exportar_pdf(
+        request, "reporte", db_report.id, db_report.report_content,
+        "Resultados del Análisis", _subtitulo_pdf(db_report.user, db_report.created_at),
+        f"resultados-{db_report.id}.pdf", "private, no-cache"
+    )
+
 @app.get("/ping")
 def ping():
     return {"status": "ok"}
\ No newline at end of file
@@ -1,14 +1,13 @@
 import os
+import html
+import re
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_postgres.vectorstores import PGVector
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
 import logging
-from sqlalchemy.ext.asyncio import create_async_engine
+import asyncio
+
+from . import crud
+from .db import database
 
 load_dotenv()
 
@@ -28,15 +27,76 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY no está configurada.")
 
-EMBEDDINGS = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GEMINI_API_KEY)
-LLM = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.7, google_api_key=GEMINI_API_KEY)
+# Modo del retriever del informe general: "hybrid", "prefilter", "vector" o "lexical".
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Máximo de tokens (estimados) de contexto que se envían en el informe general.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Informe general en dos etapas: reportes que se consultan (0 = todos) y cómo
+# se eligen. La pregunta del informe general es siempre la misma frase
+# genérica, así que su parecido con cada análisis apenas los distingue: por
+# defecto se toman los más recientes ("recency"). Con "relevance" se ordenan por
+# ese parecido más un bonus por recencia de peso REPORT_RECENCY_WEIGHT, que se
+# reduce a la mitad cada REPORT_HALF_LIFE_DAYS. Solo con "relevance" se calcula
+# el embedding del análisis al subir un reporte; al activarlo, los que faltan se
+# completan con `python -m app.reindex --summaries-only`.
+REPORT_TOP_N = int(os.getenv("REPORT_TOP_N", "8"))
+REPORT_RANKING = os.getenv("REPORT_RANKING", "recency")
+REPORT_RECENCY_WEIGHT = float(os.getenv("REPORT_RECENCY_WEIGHT", "0.1"))
+REPORT_HALF_LIFE_DAYS = float(os.getenv("REPORT_HALF_LIFE_DAYS", "180"))
+
+# Caracteres del análisis que se usan para su embedding (el modelo admite ~2048 tokens).
+SUMMARY_MAX_CHARS = 8000
+
+# Servidor alternativo (host:puerto, gRPC) para los clientes de Gemini de
+# LangChain, p. ej. el simulador de benchmarks/loadtest. El cliente de
+# app.api.utils.ia se redirige con GEMINI_BASE_URL.
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+# LangChain y los clientes de Google son costosos de importar y de construir.
+# Se cargan en el primer uso para que importar este módulo (y arrancar un
+# worker) no pague ese coste.
+
+
+def _client_options():
+    return {"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
+
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Devuelve el cliente de embeddings, creándolo en el primer uso."""
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    return GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=GEMINI_API_KEY,
+                                        client_options=_client_options())
+
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """Devuelve el LLM de Gemini, creándolo en el primer uso."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
-def get_vector_store_for_user(user_id: int) -> PGVector:
+    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.7, google_api_key=GEMINI_API_KEY,
+                                  client_options=_client_options())
+
+
+@lru_cache(maxsize=1)
+def get_async_engine():
+    """Engine asíncrono compartido (antes se creaba uno nuevo en cada informe)."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    return create_async_engine(CONNECTION_STRING)
+
+
+def get_vector_store_for_user(user_id: int):
     """Obtiene o crea el vector store para un usuario específico."""
+    from langchain_postgres.vectorstores import PGVector
+
     collection_name = f"user_{user_id}_reports"
     
     store = PGVector(
-        embeddings=EMBEDDINGS,
+        embeddings=get_embeddings(),
         collection_name=collection_name,
         connection=CONNECTION_STRING,
         use_jsonb=True # Recomendado para metadata
@@ -45,63 +105,129 @@ def get_vector_store_for_user(user_id: int) -> PGVector:
     # La colección se crea al añadir los primeros documentos.
     return store
 
-def add_pdf_to_vector_store_sync(user_id: int, file_path: str):
+def get_retriever_for_user(user_id: int, k: int = 15, mode: str = None, use_mmr: bool = False,
+                           max_reports: int = None, report_ranking: str = None):
+    """
+    Retriever híbrido (léxico + vectorial) sobre la colección del usuario. Con
+    `max_reports` solo busca en esa cantidad de reportes, elegidos según
+    `report_ranking` ("recency" o "relevance").
+    """
+    from .services.hybrid_search import HybridRetriever, MODES, REPORT_RANKINGS
+
+    mode = mode or RETRIEVAL_MODE
+    if mode not in MODES:
+        raise ValueError(f"RETRIEVAL_MODE inválido: {mode}. Opciones: {', '.join(MODES)}")
+    report_ranking = report_ranking or REPORT_RANKING
+    if report_ranking not in REPORT_RANKINGS:
+        raise ValueError(f"REPORT_RANKING inválido: {report_ranking}. Opciones: {', '.join(REPORT_RANKINGS)}")
+
+    return HybridRetriever(
+        collection_name=f"user_{user_id}_reports",
+        embeddings=get_embeddings(),
+        engine=database.engine,
+        async_engine=get_async_engine(),
+        k=k,
+        fetch_k=3 * k if use_mmr else 2 * k,
+        mode=mode,
+        use_mmr=use_mmr,
+        user_id=user_id,
+        max_reports=max_reports,
+        report_ranking=report_ranking,
+        recency_weight=REPORT_RECENCY_WEIGHT,
+        half_life_days=REPORT_HALF_LIFE_DAYS,
+    )
+
+def embed_report_summary(report_html: str):
+    """
+    Embedding del análisis de un reporte (sin etiquetas HTML). Es el que usa la
+    primera etapa del informe general para elegir en qué reportes buscar.
+    """
+    texto = html.unescape(re.sub(r"<[^>]+>", " ", report_html))
+    texto = " ".join(texto.split())[:SUMMARY_MAX_CHARS]
+    return get_embeddings().embed_documents([texto])[0]
+
+def load_and_split_pdf(file_path: str, metadata: dict = None):
+    """
+    Carga un PDF y lo divide en chunks por secciones y filas de resultados.
+    `metadata` se añade a cada chunk (p. ej. el file_hash del reporte).
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from .services.chunking import LabReportSplitter
+
+    # 1. Cargar el PDF de forma síncrona
+    loader = PyPDFLoader(file_path)
+    docs = loader.load()
+    logger.info(f"PDF cargado, {len(docs)} páginas encontradas.")
+
+    # 2. Dividir el texto en chunks por secciones y filas de resultados, sin solapamiento
+    text_splitter = LabReportSplitter(chunk_size=1500)
+    splits = text_splitter.split_documents(docs)
+    for split in splits:
+        split.metadata.update(metadata or {})
+    logger.info(f"Documento dividido en {len(splits)} chunks.")
+    return splits
+
+def add_pdf_to_vector_store_sync(user_id: int, file_path: str, file_hash: str = None):
     """
     Procesa un PDF y lo añade al vector store del usuario.
     Esta función es síncrona y está diseñada para correr en un hilo separado.
     """
+    from langchain_postgres.vectorstores import PGVector
+    from .services.hybrid_search import ensure_search_schema
+
     try:
         collection_name = f"user_{user_id}_reports"
         logger.info(f"Iniciando procesamiento de PDF para el usuario {user_id} en la colección {collection_name}")
 
         # La inicialización del vector_store ahora ocurre dentro de esta función síncrona
         vector_store = PGVector(
-            embeddings=EMBEDDINGS,
+            embeddings=get_embeddings(),
             collection_name=collection_name,
             connection=CONNECTION_STRING,
             use_jsonb=True,
         )
 
-        # 1. Cargar el PDF de forma síncrona
-        loader = PyPDFLoader(file_path)
-        docs = loader.load()
-        logger.info(f"PDF cargado, {len(docs)} páginas encontradas.")
-
-        # 2. Dividir el texto en chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=200)
-        splits = text_splitter.split_documents(docs)
-        logger.info(f"Documento dividido en {len(splits)} chunks.")
+        # El file_hash identifica a qué reporte pertenece cada chunk (lo usa el reindexador).
+        splits = load_and_split_pdf(file_path, {"user_id": user_id, "file_hash": file_hash})
 
         # 3. Añadir los chunks a la base de datos vectorial (síncrono)
         vector_store.add_documents(splits)
         logger.info(f"Chunks añadidos exitosamente a la base de datos vectorial para el usuario {user_id}.")
 
+        # La primera ingesta crea las tablas de langchain-postgres; a partir de ahí
+        # se puede añadir la columna tsvector y su índice GIN.
+        ensure_search_schema(database.engine)
+
     except Exception as e:
         logger.error(f"Error en add_pdf_to_vector_store_sync para el usuario {user_id}: {e}", exc_info=True)
         # Relanzamos la excepción para que el hilo principal se entere
         raise
 
+def _report_dates_for_user(user_id: int) -> dict:
+    """file_hash -> fecha de creación de cada reporte, para ordenar el contexto."""
+    db = database.SessionLocal()
+    try:
+        return {report.file_hash: report.created_at for report in crud.get_reports_by_user_id(db, user_id=user_id)}
+    finally:
+        db.close()
+
 async def generate_general_report(user_id: int):
     """Genera un informe general para un usuario basado en todos sus documentos."""
+    from langchain_core.prompts import ChatPromptTemplate
+    from .services.context import assemble_context, estimate_tokens
+    from .services.hybrid_search import ensure_search_schema
+
     try:
-        collection_name = f"user_{user_id}_reports"
-        
-        # Para operaciones asíncronas, es necesario un engine asíncrono.
-        async_engine = create_async_engine(CONNECTION_STRING)
+        # Idempotente y cacheado: solo consulta la base de datos la primera vez.
+        # Devuelve False si langchain-postgres aún no creó sus tablas (nadie
+        # ha subido un PDF): entonces no hay nada que buscar.
+        hay_indice = await asyncio.to_thread(ensure_search_schema, database.engine)
 
-        # Conectamos al vector store existente del usuario usando el engine asíncrono
-        vector_store = PGVector(
-            embeddings=EMBEDDINGS,
-            collection_name=collection_name,
-            connection=async_engine,
-            use_jsonb=True,
-        )
-        
-        # Comprobamos si la colección (y por tanto, la tabla) existe.
-        # Una forma indirecta es intentar obtener el retriever y ver si hay documentos.
-        # Langchain no ofrece un método 'exists()' directo y simple.
-        
-        retriever = vector_store.as_retriever(search_kwargs={'k': 15})
+        # Búsqueda léxica (tsvector) y vectorial en paralelo, fusionadas con RRF,
+        # y MMR para no gastar el contexto en chunks casi idénticos. Solo en los
+        # REPORT_TOP_N reportes más recientes (ver REPORT_RANKING), para que el
+        # historial no la encarezca.
+        retriever = get_retriever_for_user(user_id, k=15, use_mmr=True, max_reports=REPORT_TOP_N or None)
 
         prompt = ChatPromptTemplate.from_template("""
         Actúa como un médico experimentado que está revisando el historial completo de un paciente.
@@ -123,18 +249,30 @@ async def generate_general_report(user_id: int):
         Informe General:
         """)
 
-        question_answer_chain = create_stuff_documents_chain(LLM, prompt)
-        rag_chain = create_retrieval_chain(retriever, question_answer_chain)
-
         input_question = "Elabora un informe general consolidado basado en todos los documentos del historial."
-        
-        response = await rag_chain.ainvoke({"input": input_question})
-        
+
+        # Sin tablas, el contexto queda vacío (como hacía el retriever de PGVector).
+        docs = await retriever.ainvoke(input_question) if hay_indice else []
+        fechas = await asyncio.to_thread(_report_dates_for_user, user_id)
+        context, stats = assemble_context(docs, fechas, max_tokens=CONTEXT_TOKEN_BUDGET)
+
+        messages = prompt.format_messages(context=context, input=input_question)
+        response = await get_llm().ainvoke(messages)
+        answer = response.content
+
+        # Tokens del prompt: los que informa el proveedor o, si no los da, una estimación.
+        usage = getattr(response, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens") or sum(estimate_tokens(m.content) for m in messages)
+        logger.info(
+            f"Informe general del usuario {user_id}: prompt_tokens={prompt_tokens} "
+            f"({'proveedor' if usage.get('input_tokens') else 'estimado'}), contexto={stats}"
+        )
+
         # Verificación extra: si la respuesta indica que no hay contexto, lanzamos un error.
-        if "No tengo información suficiente" in response["answer"]:
+        if "No tengo información suficiente" in answer:
              raise ValueError("No se encontraron suficientes datos en el historial para generar un informe.")
 
-        return response["answer"]
+        return answer
     except ValueError as ve:
         # Capturamos el error de valor específico para dar un mensaje claro
         logger.warning(f"No se pudo generar el informe para el usuario {user_id}: {ve}")
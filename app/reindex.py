@@ -0,0 +1,352 @@
+"""
+Reindexador masivo de las colecciones de chunks por usuario.
+
+Vuelve a chunkear y a generar los embeddings de todos los reportes a partir de
+sus PDFs conservados (tabla `report_sources`), y completa las firmas MinHash y
+los embeddings de los análisis (`summary_embedding`) que falten. Sirve para
+cambiar el modelo de embeddings, el chunking o el formato de almacenamiento sin
+volver a subir PDFs.
+
+  - Cada usuario se reconstruye en una colección temporal y, al terminar, se
+    intercambia con la colección en uso dentro de una sola transacción.
+  - Los embeddings de varios reportes se generan a la vez, con varios hilos,
+    y se escriben con COPY.
+  - El progreso se guarda en un archivo de checkpoint: si el proceso se
+    interrumpe, volver a ejecutar el mismo comando continúa donde se quedó.
+
+Con `--summaries-only` solo completa los embeddings de los análisis, sin
+reconstruir las colecciones (p. ej. al pasar a REPORT_RANKING=relevance: con
+"recency" las subidas no los calculan).
+
+Uso:
+    python -m app.reindex [--workers 4] [--batch-size 64] [--user-id 1 --user-id 2]
+    python -m app.reindex --summaries-only [--workers 4]
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from . import crud, rag_service
+from .db import database
+from .db.models import models
+from .services import near_duplicates
+from .services.hybrid_search import COLLECTION_TABLE, EMBEDDING_TABLE, ensure_search_schema, vector_literal
+
+logger = logging.getLogger("app.reindex")
+
+CHECKPOINT_PATH = ".reindex_checkpoint.json"
+
+
+class Checkpoint:
+    """Estado persistente de una ejecución; se reescribe de forma atómica."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+            logger.info(f"Reanudando la ejecución {self.data['run_id']} desde {path}.")
+        else:
+            self.data = {"run_id": time.strftime("%Y%m%d%H%M%S"), "users": {}}
+
+    @property
+    def run_id(self) -> str:
+        return self.data["run_id"]
+
+    def user(self, user_id: int) -> dict:
+        return self.data["users"].setdefault(str(user_id), {"done_reports": [], "swapped": False})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class Throughput:
+    """Cuenta chunks escritos e informa chunks/seg periódicamente."""
+
+    def __init__(self, every: float = 5.0):
+        self.every = every
+        self.start = self.last_report = time.perf_counter()
+        self.chunks = 0
+
+    def add(self, n: int):
+        self.chunks += n
+        now = time.perf_counter()
+        if now - self.last_report >= self.every:
+            self.last_report = now
+            logger.info(f"{self.chunks} chunks escritos ({self.rate():.1f} chunks/seg).")
+
+    def rate(self) -> float:
+        return self.chunks / max(time.perf_counter() - self.start, 1e-9)
+
+
+def _collection_uuid(conn, name: str):
+    return conn.execute(text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"), {"name": name}).scalar()
+
+
+def _tiene_chunks(collection_uuid, report: models.Report) -> bool:
+    """Si la colección en uso tiene chunks del reporte."""
+    if collection_uuid is None:
+        return False
+    with database.engine.connect() as conn:
+        return conn.execute(
+            text(f"SELECT 1 FROM {EMBEDDING_TABLE} WHERE collection_id = :c AND cmetadata->>'file_hash' = :h LIMIT 1"),
+            {"c": collection_uuid, "h": report.file_hash},
+        ).scalar() is not None
+
+
+def _copy_chunks(collection_uuid, chunks, embeddings):
+    """Escribe un lote de chunks con COPY (mucho más rápido que INSERT fila a fila)."""
+    raw = database.engine.raw_connection()
+    try:
+        with raw.driver_connection.cursor() as cur:
+            with cur.copy(
+                f"COPY {EMBEDDING_TABLE} (id, collection_id, embedding, document, cmetadata) FROM STDIN"
+            ) as copy:
+                for chunk, embedding in zip(chunks, embeddings):
+                    copy.write_row((
+                        str(uuid.uuid4()),
+                        str(collection_uuid),
+                        vector_literal(embedding),
+                        chunk.page_content,
+                        json.dumps(chunk.metadata),
+                    ))
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def _split_report(report: models.Report):
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_file.write(report.source.content)
+        tmp_path = tmp_file.name
+    try:
+        return rag_service.load_and_split_pdf(
+            tmp_path, {"user_id": report.user_id, "file_hash": report.file_hash, "report_id": report.id}
+        )
+    finally:
+        os.unlink(tmp_path)
+
+
+def reindex_user(db, user: models.User, checkpoint: Checkpoint, pool, batch_size: int, throughput: Throughput,
+                 keep_legacy: bool = True, max_in_flight: int = 8):
+    estado = checkpoint.user(user.id)
+    if estado["swapped"]:
+        return
+
+    live_name = f"user_{user.id}_reports"
+    staging_name = f"{live_name}__reindex_{checkpoint.run_id}"
+
+    # El intercambio queda registrado en la propia colección, en su misma
+    # transacción. Si el proceso se cortó entre el intercambio y el checkpoint,
+    # repetirlo crearía una colección temporal vacía y la pondría en uso.
+    with database.engine.connect() as conn:
+        intercambiada = conn.execute(
+            text(f"SELECT 1 FROM {COLLECTION_TABLE} WHERE name = :name AND cmetadata->>'reindex_run' = :run"),
+            {"name": live_name, "run": checkpoint.run_id},
+        ).scalar()
+    if intercambiada:
+        estado["swapped"] = True
+        checkpoint.save()
+        return
+
+    # Construir el PGVector crea las tablas y la fila de la colección si faltan.
+    from langchain_postgres.vectorstores import PGVector
+    PGVector(embeddings=rag_service.get_embeddings(), collection_name=staging_name,
+             connection=rag_service.CONNECTION_STRING, use_jsonb=True)
+    ensure_search_schema(database.engine)
+    with database.engine.connect() as conn:
+        staging_uuid = _collection_uuid(conn, staging_name)
+        live_uuid = _collection_uuid(conn, live_name)
+
+    embeddings = rag_service.get_embeddings()
+    # Un reporte da pocos chunks (menos que un lote), así que esperar a cada uno
+    # antes de empezar el siguiente dejaría un solo hilo trabajando. Se piden los
+    # embeddings de varios reportes a la vez, con hasta `max_in_flight` llamadas
+    # en curso, y cada reporte se escribe y se marca en el checkpoint en orden.
+    pendientes = deque()  # (reporte, futuro del resumen, [(lote, futuro)], se reindexa)
+    en_curso = 0
+
+    def completar():
+        nonlocal en_curso
+        report, resumen, lotes, reindexado = pendientes.popleft()
+        if resumen is not None:
+            report.summary_embedding = resumen.result()
+            db.commit()
+        for lote, futuro in lotes:
+            _copy_chunks(staging_uuid, lote, futuro.result())
+            throughput.add(len(lote))
+        en_curso -= (resumen is not None) + len(lotes)
+        if reindexado:
+            estado["done_reports"].append(report.id)
+            checkpoint.save()
+
+    for report in crud.get_reports_by_user_id(db, user_id=user.id):
+        if report.id in estado["done_reports"]:
+            continue
+
+        # Reportes anteriores a la búsqueda en dos etapas: se completa el embedding
+        # de su análisis (no necesita el PDF).
+        resumen = None
+        if report.summary_embedding is None:
+            resumen = pool.submit(rag_service.embed_report_summary, report.report_content)
+
+        if report.source is None or (report.duplicate_of_id is not None and not _tiene_chunks(live_uuid, report)):
+            if report.source is None:
+                logger.warning(f"El reporte {report.id} no conserva su PDF; no se puede reindexar.")
+            # Un casi duplicado enlazado ("link") reutiliza el análisis del original
+            # y no tiene chunks propios: reindexarlo añadiría los repetidos.
+            pendientes.append((report, resumen, [], False))
+            en_curso += resumen is not None
+        else:
+            # Si una ejecución anterior se cortó a mitad de este reporte, se descartan
+            # sus chunks parciales para no duplicarlos.
+            with database.engine.begin() as conn:
+                conn.execute(
+                    text(f"DELETE FROM {EMBEDDING_TABLE} WHERE collection_id = :c AND cmetadata->>'file_hash' = :h"),
+                    {"c": staging_uuid, "h": report.file_hash},
+                )
+
+            # Reportes anteriores a la detección de casi duplicados: se completa su firma.
+            if report.minhash is None:
+                firma = near_duplicates.minhash(near_duplicates.extract_text(report.source.content))
+                if firma is not None:
+                    report.minhash = near_duplicates.to_bytes(firma)
+                    db.commit()
+
+            chunks = _split_report(report)
+            lotes = [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+            futuros = [pool.submit(embeddings.embed_documents, [c.page_content for c in lote]) for lote in lotes]
+            pendientes.append((report, resumen, list(zip(lotes, futuros)), True))
+            en_curso += (resumen is not None) + len(lotes)
+
+        while en_curso >= max_in_flight:
+            completar()
+    while pendientes:
+        completar()
+
+    # Intercambio atómico: en una sola transacción la colección reconstruida
+    # pasa a ocupar el nombre de la colección en uso.
+    with database.engine.begin() as conn:
+        # Bloquear la fila de la colección en uso hace esperar a las subidas que
+        # escriben chunks en ella (la clave foránea la bloquea en modo compartido):
+        # nada se confirma entre la copia y el borrado.
+        live_uuid = conn.execute(
+            text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name FOR UPDATE"), {"name": live_name}
+        ).scalar()
+        if live_uuid is not None:
+            # Se copian tal cual los chunks que la reconstrucción no incluye: los de
+            # reportes subidos durante la ejecución (la lista se leyó al empezar) o
+            # sin PDF conservado y, salvo --drop-legacy, los anteriores a la
+            # conservación de PDFs (sin file_hash).
+            conn.execute(text(f"""
+                INSERT INTO {EMBEDDING_TABLE} (id, collection_id, embedding, document, cmetadata)
+                SELECT gen_random_uuid()::text, :staging, embedding, document, cmetadata
+                FROM {EMBEDDING_TABLE}
+                WHERE collection_id = :live AND CASE
+                    WHEN cmetadata->>'file_hash' IS NULL THEN :keep_legacy
+                    ELSE cmetadata->>'file_hash' NOT IN (SELECT file_hash FROM reports WHERE id = ANY(:done))
+                END
+            """), {"staging": staging_uuid, "live": live_uuid, "keep_legacy": keep_legacy,
+                   "done": estado["done_reports"]})
+            # El borrado de la colección elimina sus chunks (ON DELETE CASCADE).
+            conn.execute(text(f"DELETE FROM {COLLECTION_TABLE} WHERE uuid = :live"), {"live": live_uuid})
+        conn.execute(text(f"""
+            UPDATE {COLLECTION_TABLE}
+            SET name = :live,
+                cmetadata = (CASE WHEN json_typeof(cmetadata) = 'object' THEN cmetadata::jsonb ELSE '{{}}'::jsonb END
+                             || jsonb_build_object('reindex_run', CAST(:run AS text)))::json
+            WHERE uuid = :staging
+        """), {"live": live_name, "staging": staging_uuid, "run": checkpoint.run_id})
+
+    estado["swapped"] = True
+    checkpoint.save()
+    logger.info(f"Colección {live_name} reindexada ({len(estado['done_reports'])} reportes).")
+
+
+def backfill_summaries(db, user: models.User, pool, max_in_flight: int = 8) -> int:
+    """Calcula los embeddings de los análisis que faltan. Devuelve cuántos completó."""
+    pendientes = deque()  # (reporte, futuro del resumen)
+    completados = 0
+
+    def completar():
+        nonlocal completados
+        report, resumen = pendientes.popleft()
+        report.summary_embedding = resumen.result()
+        db.commit()
+        completados += 1
+
+    for report in crud.get_reports_by_user_id(db, user_id=user.id):
+        if report.summary_embedding is not None:
+            continue
+        pendientes.append((report, pool.submit(rag_service.embed_report_summary, report.report_content)))
+        if len(pendientes) >= max_in_flight:
+            completar()
+    while pendientes:
+        completar()
+    return completados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reindexa las colecciones de chunks de los usuarios.")
+    parser.add_argument("--workers", type=int, default=4, help="Hilos para generar embeddings")
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks por llamada de embeddings y por COPY")
+    parser.add_argument("--user-id", type=int, action="append", help="Reindexar solo estos usuarios")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Archivo de progreso")
+    parser.add_argument("--drop-legacy", action="store_true",
+                        help="Descartar los chunks de reportes sin PDF conservado en vez de copiarlos")
+    parser.add_argument("--summaries-only", action="store_true",
+                        help="Solo completar los embeddings de los análisis, sin reconstruir las colecciones")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.summaries_only:
+        db = database.SessionLocal()
+        completados = 0
+        try:
+            users = crud.get_users_with_reports(db)
+            if args.user_id:
+                users = [u for u in users if u.id in args.user_id]
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                for user in users:
+                    completados += backfill_summaries(db, user, pool, max_in_flight=2 * args.workers)
+        finally:
+            db.close()
+        logger.info(f"Embeddings de análisis completados: {completados}.")
+        return
+
+    checkpoint = Checkpoint(args.checkpoint)
+    throughput = Throughput()
+
+    db = database.SessionLocal()
+    try:
+        users = crud.get_users_with_reports(db)
+        if args.user_id:
+            users = [u for u in users if u.id in args.user_id]
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for user in users:
+                reindex_user(db, user, checkpoint, pool, args.batch_size, throughput,
+                             keep_legacy=not args.drop_legacy, max_in_flight=2 * args.workers)
+    finally:
+        db.close()
+
+    checkpoint.finish()
+    logger.info(f"Reindexado completo: {throughput.chunks} chunks ({throughput.rate():.1f} chunks/seg).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Divisor de texto adaptado a informes de laboratorio.
+
+`RecursiveCharacterTextSplitter` corta las tablas de resultados a mitad de fila
+y duplica texto con el solapamiento. Este divisor:
+
+  - detecta encabezados/pies de página y membretes repetidos entre páginas:
+    descarta los pies y conserva solo la primera aparición de los encabezados,
+  - reconoce filas de tablas de resultados y nunca las parte,
+  - corta en límites de sección o de fila, sin solapamiento.
+
+El resultado son menos chunks y más densos por documento.
+"""
+import re
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# Una fila de resultados: un analito seguido de un valor numérico (con unidad o
+# rango de referencia opcionales), o varias columnas separadas por 2+ espacios
+# o tabuladores con al menos un número.
+_ROW_RE = re.compile(r"^\S.{0,80}?\s[<>≤≥]?\d+(?:[.,]\d+)?(?:\s|$|[%a-zA-Zµ/])")
+_COLUMNS_RE = re.compile(r"\S(?:\t|\s{2,})\S")
+_DIGITS_RE = re.compile(r"\d+")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def _normalizar(linea: str) -> str:
+    # Los números se igualan para que "Página 1 de 3" y "Página 2 de 3" coincidan.
+    return _DIGITS_RE.sub("#", _SPACES_RE.sub(" ", linea.strip().lower()))
+
+
+def _clave_fila(linea: str) -> str:
+    # Una fila de resultados solo se considera repetida si coincide con sus valores.
+    return _SPACES_RE.sub(" ", linea.strip().lower())
+
+
+def _paginada(apariciones: Dict[int, str]) -> bool:
+    """La línea contiene el número de su página en todas sus apariciones ("Página 2 de 3")."""
+    return all(str(pagina + 1) in _DIGITS_RE.findall(linea) for pagina, linea in apariciones.items())
+
+
+def es_fila_de_tabla(linea: str) -> bool:
+    linea = linea.strip()
+    if not linea or len(linea) > 160:
+        return False
+    return bool(_ROW_RE.match(linea)) or (bool(_COLUMNS_RE.search(linea)) and any(c.isdigit() for c in linea))
+
+
+def es_encabezado_de_seccion(linea: str) -> bool:
+    linea = linea.strip()
+    if not linea or len(linea) > 60 or es_fila_de_tabla(linea):
+        return False
+    letras = [c for c in linea if c.isalpha()]
+    return bool(letras) and (linea.endswith(":") or all(c.isupper() for c in letras))
+
+
+class LabReportSplitter:
+    """Divide las páginas de un informe de laboratorio en chunks sin solapamiento."""
+
+    def __init__(self, chunk_size: int = 1500, margin_lines: int = 4, repeat_ratio: float = 0.5):
+        self.chunk_size = chunk_size
+        # Líneas al inicio y al final de cada página donde se buscan encabezados y pies.
+        self.margin_lines = margin_lines
+        # Fracción mínima de páginas en la que debe repetirse una línea para descartarla.
+        self.repeat_ratio = repeat_ratio
+
+    def _lineas_repetidas(self, paginas: List[List[str]]) -> Tuple[set, set]:
+        """
+        Devuelve (encabezados, pies): claves de líneas que se repiten en al menos
+        `repeat_ratio` de las páginas, entre las `margin_lines` primeras
+        (encabezados y membretes, de los que se conserva la primera aparición) o
+        últimas (pies: numeración, avisos legales; se descartan siempre).
+
+        Las filas de resultados se reconocen sobre la línea original, antes de
+        igualar los números: "Glucosa 95 mg/dL" y "Glucosa 130 mg/dL" en dos
+        páginas son datos, no un membrete. Solo se tratan como repetidas si
+        llevan el número de su página o si son idénticas en todas.
+        """
+        if len(paginas) < 2:
+            return set(), set()
+        cabecera, pie = defaultdict(dict), defaultdict(dict)
+        for numero, lineas in enumerate(paginas):
+            no_vacias = [l.strip() for l in lineas if l.strip()]
+            for zona, margen in ((cabecera, no_vacias[:self.margin_lines]), (pie, no_vacias[-self.margin_lines:])):
+                for linea in margen:
+                    zona[_normalizar(linea)].setdefault(numero, linea)
+        minimo = max(2, self.repeat_ratio * len(paginas))
+
+        encabezados, pies = set(), set()
+        for zona, destino in ((pie, pies), (cabecera, encabezados)):
+            for clave, apariciones in zona.items():
+                if len(apariciones) < minimo or len(clave) > 120:
+                    continue
+                lineas = list(apariciones.values())
+                if not any(es_fila_de_tabla(l) for l in lineas) or _paginada(apariciones):
+                    destino.add(clave)
+                elif len({_clave_fila(l) for l in lineas}) == 1:
+                    # Idéntica en todas las páginas (p. ej. el teléfono del membrete):
+                    # se conserva una vez.
+                    encabezados.add(_clave_fila(lineas[0]))
+        return encabezados - pies, pies
+
+    def _unidades(self, paginas: List[List[str]]) -> List[Tuple[str, str, int]]:
+        """Convierte las páginas en unidades indivisibles: (tipo, texto, página)."""
+        repetidas, pies = self._lineas_repetidas(paginas)
+        vistas = set()
+        unidades = []
+        parrafo, pagina_parrafo = [], 0
+
+        def cerrar_parrafo():
+            if parrafo:
+                unidades.append(("parrafo", " ".join(parrafo), pagina_parrafo))
+                parrafo.clear()
+
+        for numero, lineas in enumerate(paginas):
+            for linea in lineas:
+                limpia = linea.strip()
+                if not limpia:
+                    cerrar_parrafo()
+                    continue
+                clave = _normalizar(limpia)
+                if clave in pies:
+                    continue
+                if clave not in repetidas:
+                    clave = _clave_fila(limpia)
+                if clave in repetidas:
+                    if clave in vistas:
+                        continue
+                    vistas.add(clave)
+                if es_encabezado_de_seccion(limpia):
+                    cerrar_parrafo()
+                    unidades.append(("seccion", limpia, numero))
+                elif es_fila_de_tabla(limpia):
+                    cerrar_parrafo()
+                    unidades.append(("fila", _SPACES_RE.sub(" ", limpia), numero))
+                else:
+                    if not parrafo:
+                        pagina_parrafo = numero
+                    parrafo.append(limpia)
+            cerrar_parrafo()
+        return unidades
+
+    def _partir_unidad(self, texto: str) -> List[str]:
+        """Parte en espacios una unidad que por sí sola excede `chunk_size`."""
+        partes, actual = [], ""
+        for palabra in texto.split(" "):
+            if actual and len(actual) + 1 + len(palabra) > self.chunk_size:
+                partes.append(actual)
+                actual = palabra
+            else:
+                actual = f"{actual} {palabra}" if actual else palabra
+        if actual:
+            partes.append(actual)
+        return partes
+
+    def split_pages(self, textos: List[str]) -> List[Tuple[str, int]]:
+        """Divide una lista de textos de página. Devuelve (chunk, página inicial)."""
+        chunks = []
+        actual, pagina_actual = [], 0
+        seccion, ultimo_tipo = None, None
+
+        def cerrar():
+            if actual:
+                chunks.append(("\n".join(actual), pagina_actual))
+                actual.clear()
+
+        for tipo, texto, pagina in self._unidades([t.splitlines() for t in textos]):
+            if tipo == "seccion":
+                seccion = texto
+            for parte in self._partir_unidad(texto) if len(texto) > self.chunk_size else [texto]:
+                longitud = sum(len(l) + 1 for l in actual)
+                if actual and longitud + len(parte) > self.chunk_size:
+                    # Un título de sección no se queda solo al final de un chunk.
+                    huerfano = actual.pop() if ultimo_tipo == "seccion" and len(actual) > 1 else None
+                    cerrar()
+                    pagina_actual = pagina
+                    if huerfano:
+                        actual.append(huerfano)
+                    elif tipo != "seccion" and seccion:
+                        # Una sección que continúa en otro chunk repite su título
+                        # para que las filas no pierdan contexto.
+                        actual.append(seccion)
+                if not actual:
+                    pagina_actual = pagina
+                actual.append(parte)
+                ultimo_tipo = tipo
+        cerrar()
+        return chunks
+
+    def split_documents(self, docs) -> list:
+        """Equivalente a `TextSplitter.split_documents` para las páginas de un PDF."""
+        from langchain_core.documents import Document
+
+        if not docs:
+            return []
+        chunks = self.split_pages([doc.page_content for doc in docs])
+        return [
+            Document(page_content=texto, metadata={**docs[pagina].metadata, "chunk": indice})
+            for indice, (texto, pagina) in enumerate(chunks)
+        ]
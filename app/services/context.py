@@ -0,0 +1,131 @@
+"""
+Ensamblado del contexto para el informe general consolidado.
+
+Los chunks recuperados suelen repetir texto (solapamiento entre chunks
+contiguos de la colección antigua, paneles mensuales casi idénticos). Aquí se:
+
+  - elimina el texto solapado entre chunks contiguos del mismo documento,
+  - descartan los chunks que, normalizados, ya aparecieron,
+  - respeta un presupuesto de tokens, priorizando por relevancia,
+  - ordenan los chunks seleccionados cronológicamente por reporte.
+"""
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# Solapamiento máximo que se busca entre dos chunks contiguos (el divisor
+# anterior usaba chunk_overlap=200) y mínimo para considerarlo solapamiento.
+MAX_OVERLAP = 400
+MIN_OVERLAP = 20
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(texto: str) -> int:
+    """Estimación barata de tokens (~4 caracteres por token en español)."""
+    return len(texto) // 4 + 1
+
+
+def _clave_documento(doc) -> Optional[str]:
+    return doc.metadata.get("file_hash") or doc.metadata.get("source")
+
+
+def _posicion(doc) -> Tuple[int, int]:
+    return doc.metadata.get("page", 0) or 0, doc.metadata.get("chunk", 0) or 0
+
+
+def solapamiento(anterior: str, siguiente: str) -> int:
+    """Longitud del sufijo de `anterior` que es prefijo de `siguiente`."""
+    cola = anterior[-MAX_OVERLAP:]
+    semilla = siguiente[:MIN_OVERLAP]
+    if len(semilla) < MIN_OVERLAP:
+        return 0
+    inicio = cola.find(semilla)
+    while inicio != -1:
+        candidato = cola[inicio:]
+        if siguiente.startswith(candidato):
+            return len(candidato)
+        inicio = cola.find(semilla, inicio + 1)
+    return 0
+
+
+def quitar_solapamientos(docs: list) -> Dict[int, str]:
+    """Devuelve el texto de cada chunk (por índice) sin el solapamiento con su chunk anterior."""
+    textos = {i: doc.page_content for i, doc in enumerate(docs)}
+    por_documento: Dict[str, List[int]] = {}
+    for i, doc in enumerate(docs):
+        clave = _clave_documento(doc)
+        if clave:
+            por_documento.setdefault(clave, []).append(i)
+
+    for indices in por_documento.values():
+        indices.sort(key=lambda i: _posicion(docs[i]))
+        for previo, actual in zip(indices, indices[1:]):
+            n = solapamiento(docs[previo].page_content, docs[actual].page_content)
+            if n:
+                textos[actual] = textos[actual][n:].lstrip()
+                continue
+            # Los chunks antiguos no guardan su posición dentro de la página,
+            # así que el orden puede estar invertido.
+            n = solapamiento(docs[actual].page_content, docs[previo].page_content)
+            if n:
+                textos[previo] = textos[previo][n:].lstrip()
+    return textos
+
+
+def assemble_context(docs: list, fechas: Dict[str, datetime], max_tokens: int) -> Tuple[str, dict]:
+    """
+    Construye el texto de contexto a partir de `docs` (ordenados por relevancia).
+
+    `fechas` asocia el file_hash de cada reporte con su fecha de creación; los
+    chunks se agrupan por reporte en orden cronológico. Devuelve el contexto y
+    estadísticas para el log.
+    """
+    textos = quitar_solapamientos(docs)
+
+    vistos = set()
+    seleccionados = []
+    tokens = 0
+    descartados_duplicados = descartados_presupuesto = 0
+    for i, doc in enumerate(docs):
+        texto = textos[i].strip()
+        normalizado = _SPACES_RE.sub(" ", texto.lower())
+        if not texto or normalizado in vistos:
+            descartados_duplicados += 1
+            continue
+        costo = estimate_tokens(texto)
+        if tokens + costo > max_tokens:
+            descartados_presupuesto += 1
+            continue
+        vistos.add(normalizado)
+        seleccionados.append((doc, texto))
+        tokens += costo
+
+    sin_fecha = datetime.max
+
+    def orden(item):
+        doc, _ = item
+        fecha = fechas.get(doc.metadata.get("file_hash"))
+        return (fecha.replace(tzinfo=None) if fecha else sin_fecha, _clave_documento(doc) or "", _posicion(doc))
+
+    seleccionados.sort(key=orden)
+
+    bloques = []
+    reporte_actual = object()
+    for doc, texto in seleccionados:
+        clave = _clave_documento(doc)
+        if clave != reporte_actual:
+            reporte_actual = clave
+            fecha = fechas.get(doc.metadata.get("file_hash"))
+            bloques.append(f"--- Informe del {fecha:%Y-%m-%d} ---" if fecha else "--- Informe sin fecha ---")
+        bloques.append(texto)
+
+    estadisticas = {
+        "chunks_recuperados": len(docs),
+        "chunks_usados": len(seleccionados),
+        "descartados_duplicados": descartados_duplicados,
+        "descartados_presupuesto": descartados_presupuesto,
+        "tokens_contexto": tokens,
+        "tokens_originales": sum(estimate_tokens(doc.page_content) for doc in docs),
+    }
+    return "\n\n".join(bloques), estadisticas
@@ -0,0 +1,420 @@
+"""
+Búsqueda híbrida (léxica + vectorial) sobre las tablas de langchain-postgres.
+
+Los informes de laboratorio contienen tokens exactos (analitos, códigos como
+"HbA1c" o "TSH", unidades) que la similitud de embeddings no siempre recupera.
+Este módulo mantiene una columna `tsvector` con índice GIN junto a los
+embeddings de cada chunk, ejecuta la búsqueda léxica y la vectorial en paralelo
+y fusiona ambos rankings con Reciprocal Rank Fusion (RRF).
+
+Opcionalmente la búsqueda es en dos etapas: primero se eligen reportes del
+usuario (los más recientes, o los más parecidos a la consulta por el embedding
+de su análisis con un bonus por recencia) y luego solo se buscan chunks de esos
+reportes. Así el coste y el ruido no crecen con el tamaño del historial.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+TS_CONFIG = "spanish"
+
+MODES = ("hybrid", "prefilter", "vector", "lexical")
+REPORT_RANKINGS = ("recency", "relevance")
+
+_schema_ready = False
+
+# La consulta léxica usa OR entre términos: con AND (comportamiento de
+# plainto_tsquery) una pregunta larga no coincidiría con ningún chunk.
+_TSQUERY = f"to_tsquery('{TS_CONFIG}', replace(plainto_tsquery('{TS_CONFIG}', :query)::text, '&', '|'))"
+
+_LEXICAL_SQL = f"""
+    SELECT {{columnas}}, ts_rank_cd(e.document_tsv, q) AS score
+    FROM {EMBEDDING_TABLE} e
+    JOIN {COLLECTION_TABLE} c ON c.uuid = e.collection_id,
+         {_TSQUERY} q
+    WHERE c.name = :collection AND e.document_tsv @@ q {{filtro}}
+    ORDER BY score DESC
+    LIMIT :k
+"""
+
+_VECTOR_SQL = f"""
+    SELECT {{columnas}}, e.embedding <=> CAST(:embedding AS vector) AS score
+    FROM {EMBEDDING_TABLE} e
+    JOIN {COLLECTION_TABLE} c ON c.uuid = e.collection_id
+    WHERE c.name = :collection {{filtro}}
+    ORDER BY score
+    LIMIT :k
+"""
+
+_FILE_HASH = "(e.cmetadata->>'file_hash')"
+
+# Reportes del usuario candidatos a la primera etapa, con el file_hash de sus
+# chunks. Un casi duplicado con acción "link" reutiliza el análisis (y el
+# embedding) de otro reporte y no tiene chunks propios: se cuenta como el
+# reporte del que se copió (siguiendo la cadena si ese también es un "link"),
+# para que no ocupe un puesto sin aportar chunks ni repita el del original.
+_CANDIDATOS_CTE = f"""
+    WITH RECURSIVE origen AS (
+        SELECT id, file_hash, duplicate_of_id, 0 AS saltos
+        FROM reports WHERE user_id = :user_id
+        UNION ALL
+        SELECT origen.id, o.file_hash, o.duplicate_of_id, origen.saltos + 1
+        FROM origen JOIN reports o ON o.id = origen.duplicate_of_id
+        WHERE origen.saltos < 10 AND NOT EXISTS (
+            SELECT 1 FROM {EMBEDDING_TABLE} e
+            JOIN {COLLECTION_TABLE} c ON c.uuid = e.collection_id
+            WHERE c.name = :collection AND {_FILE_HASH} = origen.file_hash
+        )
+    ),
+    candidatos AS (
+        SELECT DISTINCT ON (origen.id) origen.file_hash, r.created_at, r.summary_embedding
+        FROM origen JOIN reports r ON r.id = origen.id
+        ORDER BY origen.id, origen.saltos DESC
+    )
+"""
+
+# Primera etapa por recencia: los reportes de los `n` análisis más recientes.
+_RECENT_REPORTS_SQL = _CANDIDATOS_CTE + """
+    SELECT file_hash FROM candidatos
+    GROUP BY file_hash
+    ORDER BY max(created_at) DESC
+    LIMIT :n
+"""
+
+# Primera etapa por relevancia: los `n` reportes más parecidos a la consulta,
+# con un bonus por recencia que se reduce a la mitad cada `half_life_days`. Los
+# reportes sin embedding (anteriores a esta columna) se incluyen siempre.
+_REPORTS_SQL = _CANDIDATOS_CTE + """
+    SELECT file_hash FROM candidatos WHERE summary_embedding IS NULL
+    UNION ALL
+    (SELECT file_hash FROM candidatos
+     WHERE summary_embedding IS NOT NULL
+     GROUP BY file_hash
+     ORDER BY max((1 - (summary_embedding <=> CAST(:embedding AS vector)))
+                  + :recency_weight * power(0.5, extract(epoch FROM now() - created_at) / 86400.0 / :half_life_days))
+              DESC
+     LIMIT :n)
+"""
+
+
+def ensure_search_schema(engine) -> bool:
+    """
+    Añade (si no existen) la columna `document_tsv` y su índice GIN.
+    Es idempotente. Devuelve False si langchain-postgres aún no creó sus tablas.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return True
+
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:tabla)"), {"tabla": EMBEDDING_TABLE}).scalar() is None:
+            return False
+        conn.execute(text(
+            f"ALTER TABLE {EMBEDDING_TABLE} ADD COLUMN IF NOT EXISTS document_tsv tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', coalesce(document, ''))) STORED"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{EMBEDDING_TABLE}_document_tsv "
+            f"ON {EMBEDDING_TABLE} USING GIN (document_tsv)"
+        ))
+        # Para restringir la búsqueda a los chunks de ciertos reportes.
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{EMBEDDING_TABLE}_file_hash "
+            f"ON {EMBEDDING_TABLE} ((cmetadata->>'file_hash'))"
+        ))
+
+    _schema_ready = True
+    logger.info("Índice de búsqueda léxica listo en %s.", EMBEDDING_TABLE)
+    return True
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """Fusiona varios rankings: cada fila suma 1 / (k + posición) por ranking en el que aparece."""
+    puntajes = defaultdict(float)
+    filas = {}
+    for ranking in rankings:
+        for posicion, fila in enumerate(ranking, start=1):
+            puntajes[fila["id"]] += 1.0 / (k + posicion)
+            filas.setdefault(fila["id"], fila)
+    orden = sorted(puntajes, key=puntajes.get, reverse=True)
+    return [dict(filas[id_], score=puntajes[id_]) for id_ in orden]
+
+
+def vector_literal(embedding: List[float]) -> str:
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def parse_vector(valor: str) -> List[float]:
+    return [float(x) for x in valor.strip("[]").split(",")]
+
+
+def _columnas(con_embedding: bool) -> str:
+    # El embedding solo se trae cuando hace falta para MMR: son cientos de floats por fila.
+    return "e.id, e.document, e.cmetadata" + (", e.embedding::text AS embedding" if con_embedding else "")
+
+
+def _filtro(ids: Optional[List[str]] = None, file_hashes: Optional[List[str]] = None) -> str:
+    filtro = ""
+    if ids is not None:
+        filtro += " AND e.id = ANY(:ids)"
+    if file_hashes is not None:
+        # Los chunks sin file_hash (anteriores a guardarlo) no se pueden asignar a un reporte.
+        filtro += f" AND ({_FILE_HASH} = ANY(:file_hashes) OR {_FILE_HASH} IS NULL)"
+    return filtro
+
+
+def _similitudes(filas: List[Dict[str, Any]]) -> List[float]:
+    """Similitud coseno con la consulta de las filas de la búsqueda vectorial (su score es la distancia)."""
+    return [1 - fila["score"] for fila in filas]
+
+
+def _normalizar(filas: List[Dict[str, Any]]) -> List[float]:
+    """Puntaje RRF de cada fila relativo al primero (en (0, 1])."""
+    maximo = max(fila["score"] for fila in filas)
+    return [fila["score"] / maximo for fila in filas]
+
+
+def maximal_marginal_relevance(relevancia: List[float], vectores: List[List[float]], k: int,
+                               lambda_mult: float = 0.5) -> List[int]:
+    """
+    Índices de `k` candidatos elegidos por MMR: en cada paso, el que maximiza
+    lambda_mult * relevancia - (1 - lambda_mult) * (similitud coseno máxima
+    con los ya elegidos). La relevancia la da el ranking de origen (p. ej. el
+    puntaje RRF), no solo el parecido con el embedding de la consulta.
+    """
+    import numpy as np
+
+    matriz = np.array(vectores, dtype=np.float32)
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    matriz /= np.where(normas == 0, 1, normas)
+    similitud = matriz @ matriz.T
+    relevancia = np.array(relevancia, dtype=np.float32)
+
+    elegidos = [int(np.argmax(relevancia))]
+    maxima = similitud[elegidos[0]].copy()
+    while len(elegidos) < min(k, len(relevancia)):
+        puntaje = lambda_mult * relevancia - (1 - lambda_mult) * maxima
+        puntaje[elegidos] = -np.inf
+        elegido = int(np.argmax(puntaje))
+        elegidos.append(elegido)
+        maxima = np.maximum(maxima, similitud[elegido])
+    return elegidos
+
+
+def _to_documents(filas: List[Dict[str, Any]]) -> List[Document]:
+    return [
+        Document(id=fila["id"], page_content=fila["document"], metadata=dict(fila["cmetadata"] or {}))
+        for fila in filas
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever de una colección de PGVector que combina búsqueda léxica y vectorial.
+
+    Modos:
+      - "hybrid":    ambas búsquedas en paralelo, fusionadas con RRF.
+      - "prefilter": la búsqueda léxica selecciona hasta `prefilter_k` candidatos
+                     y la vectorial solo ordena dentro de ellos.
+      - "vector" / "lexical": una sola de las búsquedas.
+
+    Con `max_reports` (y `user_id`) se busca en dos etapas: primero se eligen
+    los reportes y las búsquedas de chunks se limitan a ellos. Con
+    `report_ranking="recency"` son los más recientes; con "relevance", los más
+    parecidos al embedding de la consulta, y la búsqueda léxica espera entonces
+    al embedding. El modo "lexical" no calcula embedding y busca en todos los
+    reportes.
+    """
+
+    collection_name: str
+    embeddings: Any
+    engine: Any
+    async_engine: Any = None
+    k: int = 15
+    fetch_k: int = 30
+    prefilter_k: int = 200
+    rrf_k: int = 60
+    mode: str = "hybrid"
+    # Con MMR se recuperan `fetch_k` candidatos y se eligen `k` relevantes pero
+    # distintos entre sí (evita chunks casi idénticos de paneles repetidos).
+    use_mmr: bool = False
+    lambda_mult: float = 0.5
+    # Búsqueda en dos etapas (ver _RECENT_REPORTS_SQL y _REPORTS_SQL).
+    user_id: Optional[int] = None
+    max_reports: Optional[int] = None
+    report_ranking: str = "relevance"
+    recency_weight: float = 0.1
+    half_life_days: float = 180.0
+
+    @property
+    def _dos_etapas(self) -> bool:
+        return bool(self.max_reports) and self.user_id is not None
+
+    @property
+    def _por_relevancia(self) -> bool:
+        # Solo la primera etapa por relevancia necesita el embedding de la consulta.
+        return self.report_ranking == "relevance"
+
+    def _lexical_sql(self, file_hashes: Optional[List[str]]) -> str:
+        return _LEXICAL_SQL.format(columnas=_columnas(self.use_mmr), filtro=_filtro(file_hashes=file_hashes))
+
+    def _vector_sql(self, ids: Optional[List[str]], file_hashes: Optional[List[str]]) -> str:
+        return _VECTOR_SQL.format(columnas=_columnas(self.use_mmr), filtro=_filtro(ids, file_hashes))
+
+    def _reports_sql(self) -> str:
+        return _REPORTS_SQL if self._por_relevancia else _RECENT_REPORTS_SQL
+
+    def _reports_params(self, embedding: Optional[List[float]]) -> Dict[str, Any]:
+        parametros = {"user_id": self.user_id, "collection": self.collection_name, "n": self.max_reports}
+        if self._por_relevancia:
+            parametros.update(
+                embedding=vector_literal(embedding),
+                recency_weight=self.recency_weight,
+                half_life_days=self.half_life_days,
+            )
+        return parametros
+
+    def _lexical_params(self, query: str, k: int, file_hashes: Optional[List[str]]) -> Dict[str, Any]:
+        parametros = {"query": query, "collection": self.collection_name, "k": k}
+        if file_hashes is not None:
+            parametros["file_hashes"] = file_hashes
+        return parametros
+
+    def _vector_params(self, embedding: List[float], k: int, ids: Optional[List[str]],
+                       file_hashes: Optional[List[str]]) -> Dict[str, Any]:
+        parametros = {"embedding": vector_literal(embedding), "collection": self.collection_name, "k": k}
+        if ids is not None:
+            parametros["ids"] = ids
+        if file_hashes is not None:
+            parametros["file_hashes"] = file_hashes
+        return parametros
+
+    def _seleccionar(self, filas: List[Dict[str, Any]], relevancia: Optional[List[float]] = None) -> List[Document]:
+        """
+        Elige los `k` resultados finales: los primeros, o por MMR si está
+        activado. `relevancia` es la de cada fila en el ranking que se
+        diversifica: en modo híbrido el puntaje RRF, para que los resultados
+        solo léxicos (códigos, unidades) no se reordenen por el embedding.
+        """
+        if not self.use_mmr or relevancia is None or len(filas) <= self.k:
+            return _to_documents(filas[: self.k])
+
+        indices = maximal_marginal_relevance(
+            relevancia, [parse_vector(fila["embedding"]) for fila in filas], self.k, self.lambda_mult
+        )
+        return _to_documents([filas[i] for i in indices])
+
+    # --- Consultas síncronas ---
+
+    def _reports(self, embedding: Optional[List[float]]) -> Optional[List[str]]:
+        """Primera etapa: file_hash de los reportes en los que buscar (None: todos)."""
+        with self.engine.connect() as conn:
+            hashes = [fila[0] for fila in conn.execute(text(self._reports_sql()), self._reports_params(embedding))]
+        return hashes or None
+
+    def _lexical(self, query: str, k: int, file_hashes: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            resultado = conn.execute(text(self._lexical_sql(file_hashes)), self._lexical_params(query, k, file_hashes))
+            return [dict(fila) for fila in resultado.mappings()]
+
+    def _vector(self, embedding: List[float], k: int, ids: Optional[List[str]] = None,
+                file_hashes: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            resultado = conn.execute(text(self._vector_sql(ids, file_hashes)),
+                                     self._vector_params(embedding, k, ids, file_hashes))
+            return [dict(fila) for fila in resultado.mappings()]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.mode == "lexical":
+            return self._seleccionar(self._lexical(query, self.k))
+        if self.mode == "vector":
+            embedding = self.embeddings.embed_query(query)
+            hashes = self._reports(embedding) if self._dos_etapas else None
+            filas = self._vector(embedding, self.fetch_k if self.use_mmr else self.k, file_hashes=hashes)
+            return self._seleccionar(filas, _similitudes(filas))
+
+        # El embedding de la consulta (llamada de red) y la búsqueda léxica van en
+        # paralelo, salvo en dos etapas por relevancia: la léxica necesita antes
+        # los reportes, y estos el embedding.
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futuro_embedding = pool.submit(self.embeddings.embed_query, query)
+            hashes = None
+            if self._dos_etapas:
+                hashes = self._reports(futuro_embedding.result() if self._por_relevancia else None)
+            if self.mode == "prefilter":
+                candidatos = self._lexical(query, self.prefilter_k, hashes)
+                ids = [fila["id"] for fila in candidatos] or None
+                filas = self._vector(futuro_embedding.result(), self.fetch_k, ids, hashes)
+                return self._seleccionar(filas, _similitudes(filas))
+
+            futuro_vector = pool.submit(
+                lambda: self._vector(futuro_embedding.result(), self.fetch_k, file_hashes=hashes)
+            )
+            lexico = self._lexical(query, self.fetch_k, hashes)
+            vector = futuro_vector.result()
+        fusion = reciprocal_rank_fusion([vector, lexico], self.rrf_k)
+        return self._seleccionar(fusion, _normalizar(fusion) if fusion else None)
+
+    # --- Consultas asíncronas ---
+
+    async def _areports(self, embedding: Optional[List[float]]) -> Optional[List[str]]:
+        async with self.async_engine.connect() as conn:
+            resultado = await conn.execute(text(self._reports_sql()), self._reports_params(embedding))
+            hashes = [fila[0] for fila in resultado]
+        return hashes or None
+
+    async def _alexical(self, query: str, k: int, file_hashes: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        async with self.async_engine.connect() as conn:
+            resultado = await conn.execute(text(self._lexical_sql(file_hashes)),
+                                           self._lexical_params(query, k, file_hashes))
+            return [dict(fila) for fila in resultado.mappings()]
+
+    async def _avector(self, embedding: List[float], k: int, ids: Optional[List[str]] = None,
+                       file_hashes: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        async with self.async_engine.connect() as conn:
+            resultado = await conn.execute(text(self._vector_sql(ids, file_hashes)),
+                                           self._vector_params(embedding, k, ids, file_hashes))
+            return [dict(fila) for fila in resultado.mappings()]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.async_engine is None:
+            return await asyncio.to_thread(self._get_relevant_documents, query, run_manager=run_manager.get_sync())
+
+        if self.mode == "lexical":
+            return self._seleccionar(await self._alexical(query, self.k))
+        if self.mode == "vector":
+            embedding = await self.embeddings.aembed_query(query)
+            hashes = await self._areports(embedding) if self._dos_etapas else None
+            filas = await self._avector(embedding, self.fetch_k if self.use_mmr else self.k, file_hashes=hashes)
+            return self._seleccionar(filas, _similitudes(filas))
+
+        embedding_futuro = asyncio.ensure_future(self.embeddings.aembed_query(query))
+        hashes = None
+        if self._dos_etapas:
+            hashes = await self._areports(await embedding_futuro if self._por_relevancia else None)
+
+        if self.mode == "prefilter":
+            candidatos = await self._alexical(query, self.prefilter_k, hashes)
+            ids = [fila["id"] for fila in candidatos] or None
+            filas = await self._avector(await embedding_futuro, self.fetch_k, ids, hashes)
+            return self._seleccionar(filas, _similitudes(filas))
+
+        async def buscar_vector():
+            return await self._avector(await embedding_futuro, self.fetch_k, file_hashes=hashes)
+
+        vector, lexico = await asyncio.gather(buscar_vector(), self._alexical(query, self.fetch_k, hashes))
+        fusion = reciprocal_rank_fusion([vector, lexico], self.rrf_k)
+        return self._seleccionar(fusion, _normalizar(fusion) if fusion else None)
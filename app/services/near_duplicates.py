@@ -0,0 +1,195 @@
+"""
+Detección de documentos casi duplicados con MinHash + LSH.
+
+El hash SHA-256 del archivo solo detecta copias byte a byte. Un mismo resultado
+reexportado o escaneado de nuevo tiene otros bytes pero el mismo contenido.
+Aquí se calcula una firma MinHash sobre el texto normalizado de cada reporte,
+que se guarda en `reports.minhash`, y se mantiene en memoria un índice LSH por
+usuario para consultar en la subida sin tocar la base de datos.
+
+La similitud estimada (fracción de valores iguales en la firma) aproxima el
+índice de Jaccard entre los conjuntos de shingles de ambos textos.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+# Similitud mínima para considerar un documento casi duplicado y qué hacer:
+#   "skip": no se procesa; se devuelve el reporte existente.
+#   "link": se crea el reporte reutilizando el análisis existente, sin llamar a
+#           Gemini ni añadir chunks, y se enlaza con `duplicate_of_id`.
+#   "flag": se procesa normalmente y solo se marca con `duplicate_of_id`.
+# "skip" y "link" solo se aplican si además los valores numéricos coinciden
+# (ver `mismos_valores`); si no, el documento se trata como "flag".
+THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+ACTION = os.getenv("NEAR_DUPLICATE_ACTION", "link")
+ACTIONS = ("skip", "link", "flag")
+if ACTION not in ACTIONS:
+    raise ValueError(f"NEAR_DUPLICATE_ACTION inválida: {ACTION}. Opciones: {', '.join(ACTIONS)}")
+
+# Los ids se asignan al insertar y no al confirmar: un reporte de otro worker
+# puede hacerse visible después que otro de id mayor. sync() vuelve a consultar
+# este margen de ids por debajo de lo ya cargado para no perderlo.
+_SOLAPAMIENTO_IDS = 1000
+
+_NO_ALFANUMERICO_RE = re.compile(r"[^0-9a-z]+")
+_NUMERO_RE = re.compile(r"\b\d+\b")
+
+
+@lru_cache(maxsize=1)
+def _permutaciones():
+    """
+    Coeficientes (a, b) del hashing multiplicativo. numpy se importa aquí, en la
+    primera firma, y no al importar el módulo (lo importa app.main).
+    """
+    import numpy as np
+
+    rng = np.random.RandomState(20240619)
+    a = rng.randint(1, 2**63, size=NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+    return a, b
+
+
+def extract_text(content: bytes) -> str:
+    """Extrae el texto de un PDF en memoria."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(content))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def normalizar(texto: str) -> str:
+    # Sin acentos, mayúsculas ni puntuación: las diferencias de exportación u
+    # OCR en esos detalles no deben cambiar la firma.
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO_RE.sub(" ", texto).strip()
+
+
+def minhash(texto: str) -> Optional["np.ndarray"]:
+    """Firma MinHash (NUM_PERM enteros de 32 bits) o None si el texto está vacío."""
+    import numpy as np
+
+    palabras = normalizar(texto).split()
+    if not palabras:
+        return None
+    n = max(1, len(palabras) - SHINGLE_SIZE + 1)
+    shingles = {" ".join(palabras[i:i + SHINGLE_SIZE]) for i in range(n)}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # Hashing multiplicativo (a*x + b mod 2^64, bits altos): una permutación por columna.
+    a, b = _permutaciones()
+    with np.errstate(over="ignore"):
+        valores = (hashes[:, None] * a[None, :] + b[None, :]) >> np.uint64(32)
+    return valores.min(axis=0).astype(np.uint32)
+
+
+def mismos_valores(texto_a: str, texto_b: str) -> bool:
+    """
+    Comprueba que ambos textos contengan exactamente los mismos números. Un
+    resultado reexportado los conserva; otro análisis con un valor distinto
+    puede superar el umbral de similitud y no debe reutilizar el análisis.
+    """
+    numeros_a = sorted(_NUMERO_RE.findall(normalizar(texto_a)))
+    numeros_b = sorted(_NUMERO_RE.findall(normalizar(texto_b)))
+    return numeros_a == numeros_b
+
+
+def to_bytes(firma: "np.ndarray") -> bytes:
+    return firma.astype("<u4").tobytes()
+
+
+def from_bytes(datos: bytes) -> "np.ndarray":
+    import numpy as np
+
+    return np.frombuffer(datos, dtype="<u4").astype(np.uint32)
+
+
+def similitud(a: "np.ndarray", b: "np.ndarray") -> float:
+    return int((a == b).sum()) / NUM_PERM
+
+
+def _bandas(firma: "np.ndarray") -> Iterable[Tuple[int, bytes]]:
+    for banda in range(BANDS):
+        yield banda, firma[banda * ROWS:(banda + 1) * ROWS].tobytes()
+
+
+class _IndiceUsuario:
+    def __init__(self):
+        self.cubetas: Dict[Tuple[int, bytes], set] = defaultdict(set)
+        self.firmas: Dict[int, "np.ndarray"] = {}
+        # Mayor id cargado de la base de datos. Solo lo mueve sync(): los
+        # reportes añadidos por este worker no cuentan, porque otro worker
+        # puede confirmar después uno de id menor.
+        self.cargado_hasta = 0
+
+
+class NearDuplicateIndex:
+    """
+    Índice LSH en memoria, por usuario. Se completa de forma incremental con los
+    reportes que otros workers hayan guardado (los de id mayor al último cargado,
+    con un margen de solapamiento).
+    """
+
+    def __init__(self):
+        self._usuarios: Dict[int, _IndiceUsuario] = defaultdict(_IndiceUsuario)
+        self._lock = threading.Lock()
+
+    def add(self, user_id: int, report_id: int, firma: "np.ndarray"):
+        with self._lock:
+            indice = self._usuarios[user_id]
+            indice.firmas[report_id] = firma
+            for clave in _bandas(firma):
+                indice.cubetas[clave].add(report_id)
+
+    def remove(self, user_id: int, report_id: int):
+        with self._lock:
+            indice = self._usuarios[user_id]
+            firma = indice.firmas.pop(report_id, None)
+            if firma is not None:
+                for clave in _bandas(firma):
+                    indice.cubetas[clave].discard(report_id)
+
+    def sync(self, user_id: int, cargar: Callable[[int, int], Iterable[Tuple[int, bytes]]]):
+        """Añade las firmas guardadas que aún no están en el índice; `cargar(user_id, after_id)`."""
+        indice = self._usuarios[user_id]
+        for report_id, datos in cargar(user_id, max(0, indice.cargado_hasta - _SOLAPAMIENTO_IDS)):
+            if report_id not in indice.firmas:
+                self.add(user_id, report_id, from_bytes(datos))
+            with self._lock:
+                indice.cargado_hasta = max(indice.cargado_hasta, report_id)
+
+    def query(self, user_id: int, firma: "np.ndarray", threshold: float) -> Optional[Tuple[int, float]]:
+        """Reporte más parecido con similitud >= threshold, como (report_id, similitud)."""
+        with self._lock:
+            indice = self._usuarios[user_id]
+            candidatos = set()
+            for clave in _bandas(firma):
+                candidatos |= indice.cubetas.get(clave, set())
+            mejor = None
+            for report_id in candidatos:
+                s = similitud(firma, indice.firmas[report_id])
+                if s >= threshold and (mejor is None or s > mejor[1]):
+                    mejor = (report_id, s)
+            return mejor
+
+
+# Índice compartido por las peticiones de este worker.
+index = NearDuplicateIndex()
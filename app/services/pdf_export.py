@@ -0,0 +1,394 @@
+"""
+Exportación a PDF de los resultados y del informe general consolidado.
+
+Generar un PDF con reportlab cuesta CPU, así que:
+
+  - se renderiza en un pool de procesos, fuera del event loop y sin competir
+    por el GIL con las peticiones,
+  - cada PDF se guarda en EXPORT_DIR con un nombre derivado del objeto y de la
+    versión de su contenido (hash del HTML, títulos y LAYOUT_VERSION): mientras
+    el contenido no cambie se sirve el mismo archivo, y la versión sirve de ETag,
+  - las peticiones simultáneas del mismo PDF comparten un único renderizado.
+
+Entre workers no hace falta coordinar: dos procesos que rendericen la misma
+versión escriben el mismo contenido y el reemplazo del archivo es atómico.
+
+Cada informe general genera una fuente nueva (el modelo nunca responde igual)
+y cada versión de un contenido un PDF, así que EXPORT_DIR se limpia: se borran
+los archivos sin usar en EXPORT_MAX_AGE_DAYS días y, si aun así ocupan más de
+EXPORT_MAX_MB, los usados hace más tiempo. Usar un archivo actualiza su fecha
+de modificación. EXPORT_DIR debe ser un directorio persistente: si se vacía
+(p. ej. un /tmp que se limpia al reiniciar), los enlaces `pdf_url` de los
+informes generales ya entregados dejan de funcionar.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Optional, Tuple
+from xml.sax.saxutils import escape
+
+from .single_flight import LiderCancelado, SingleFlight
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "asistente-medico-exports"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(min(2, os.cpu_count() or 1))))
+EXPORT_MAX_AGE_DAYS = float(os.getenv("EXPORT_MAX_AGE_DAYS", "30"))
+EXPORT_MAX_MB = float(os.getenv("EXPORT_MAX_MB", "500"))
+# Intervalo mínimo entre dos limpiezas de EXPORT_DIR en un mismo proceso.
+_LIMPIEZA_CADA_S = 600
+_ultima_limpieza = 0.0
+
+# Cambiarlo invalida todos los PDF guardados (p. ej. al modificar el diseño).
+LAYOUT_VERSION = "1"
+
+# Renderizados en curso en este proceso, por ruta de destino.
+_en_curso = SingleFlight()
+
+
+def version(contenido_html: str, titulo: str, subtitulo: str = "") -> str:
+    datos = "\0".join((LAYOUT_VERSION, titulo, subtitulo, contenido_html))
+    return hashlib.sha256(datos.encode()).hexdigest()[:16]
+
+
+def _ruta(tipo: str, objeto_id: int, ver: str, extension: str) -> str:
+    return os.path.join(EXPORT_DIR, f"{tipo}-{objeto_id}-{ver}.{extension}")
+
+
+def _escribir_atomico(ruta: str, datos: bytes):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _marcar_uso(ruta: str) -> bool:
+    """Actualiza la fecha de modificación (la limpieza borra primero lo menos usado). False si no existe."""
+    try:
+        os.utime(ruta)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def limpiar(ahora: Optional[float] = None) -> int:
+    """
+    Borra de EXPORT_DIR los archivos sin usar desde hace más de
+    EXPORT_MAX_AGE_DAYS días y, si el resto ocupa más de EXPORT_MAX_MB, los
+    usados hace más tiempo hasta quedar por debajo. Devuelve cuántos borró.
+    """
+    ahora = time.time() if ahora is None else ahora
+    archivos = []
+    try:
+        with os.scandir(EXPORT_DIR) as entradas:
+            for entrada in entradas:
+                try:
+                    if entrada.is_file():
+                        info = entrada.stat()
+                        archivos.append((info.st_mtime, info.st_size, entrada.path))
+                except FileNotFoundError:
+                    # Otro worker lo borró o lo reemplazó mientras se recorría.
+                    continue
+    except FileNotFoundError:
+        return 0
+
+    archivos.sort()
+    limite_edad = ahora - EXPORT_MAX_AGE_DAYS * 86400
+    limite_bytes = EXPORT_MAX_MB * 1024 * 1024
+    total = sum(tamano for _, tamano, _ in archivos)
+    borrados = 0
+    # Del más antiguo al más reciente: se para en el primero que se conserva.
+    for modificado, tamano, ruta in archivos:
+        if modificado >= limite_edad and total <= limite_bytes:
+            break
+        try:
+            os.unlink(ruta)
+            borrados += 1
+        except FileNotFoundError:
+            pass
+        total -= tamano
+    if borrados:
+        logger.info(f"Limpieza de {EXPORT_DIR}: {borrados} archivos borrados, quedan {total / 1024 / 1024:.1f} MB.")
+    return borrados
+
+
+def _limpiar_si_toca():
+    """Limpia EXPORT_DIR como mucho una vez cada _LIMPIEZA_CADA_S en este proceso."""
+    global _ultima_limpieza
+    ahora = time.time()
+    if ahora - _ultima_limpieza < _LIMPIEZA_CADA_S:
+        return
+    _ultima_limpieza = ahora
+    try:
+        limpiar(ahora)
+    except OSError as e:
+        logger.warning(f"No se pudo limpiar {EXPORT_DIR}: {e}")
+
+
+# --- Fuente de documentos que no están en la base de datos ---
+
+def guardar_fuente(tipo: str, objeto_id: int, contenido_html: str, titulo: str, subtitulo: str = "") -> str:
+    """
+    Guarda el HTML de un documento para exportarlo después (el informe general
+    no se persiste en la base de datos). Devuelve su versión.
+    """
+    ver = version(contenido_html, titulo, subtitulo)
+    ruta = _ruta(tipo, objeto_id, ver, "json")
+    if not _marcar_uso(ruta):
+        fuente = {"html": contenido_html, "titulo": titulo, "subtitulo": subtitulo}
+        _escribir_atomico(ruta, json.dumps(fuente, ensure_ascii=False).encode())
+        _limpiar_si_toca()
+    return ver
+
+
+def cargar_fuente(tipo: str, objeto_id: int, ver: str) -> Optional[dict]:
+    ruta = _ruta(tipo, objeto_id, ver, "json")
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            fuente = json.load(f)
+    except FileNotFoundError:
+        return None
+    _marcar_uso(ruta)
+    return fuente
+
+
+# --- Renderizado ---
+
+class _HtmlAFlowables(HTMLParser):
+    """
+    Convierte el HTML de los análisis (el que produce app.api.utils.markdown y
+    el de los reportes antiguos, texto con <br> y <strong>) en flowables.
+    Las etiquetas desconocidas se ignoran y se conserva su texto.
+    """
+
+    def __init__(self, estilos, ancho):
+        super().__init__(convert_charrefs=True)
+        self.estilos = estilos
+        self.ancho = ancho
+        self.flowables = []
+        self._texto = []
+        self._estilo = "Normal"
+        self._listas = []
+        self._bullet = None
+        self._tabla = None
+        self._fila = None
+        self._celda_cabecera = False
+
+    def _vaciar(self):
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.platypus import Paragraph
+
+        marcado = "".join(self._texto).strip()
+        self._texto = []
+        if marcado.endswith("<br/>"):
+            marcado = marcado[:-5].rstrip()
+        if not marcado and self._bullet is None:
+            return
+        if self._fila is not None:
+            estilo = self.estilos["Celda" + ("Cabecera" if self._celda_cabecera else "")]
+            self._fila.append(Paragraph(marcado, estilo))
+            return
+        if self._listas:
+            nivel = len(self._listas)
+            estilo = ParagraphStyle(
+                f"Lista{nivel}", parent=self.estilos["Normal"],
+                leftIndent=14 * nivel + 6, bulletIndent=14 * nivel - 6, spaceAfter=2,
+            )
+            self.flowables.append(Paragraph(marcado, estilo, bulletText=self._bullet))
+            self._bullet = None
+            return
+        self.flowables.append(Paragraph(marcado, self.estilos[self._estilo]))
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("strong", "b"):
+            self._texto.append("<b>")
+        elif tag in ("em", "i"):
+            self._texto.append("<i>")
+        elif tag == "code":
+            self._texto.append('<font face="Courier">')
+        elif tag == "br":
+            self._texto.append("<br/>")
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._vaciar()
+            self._estilo = "Titulo" if tag in ("h1", "h2", "h3") else "Subtitulo"
+        elif tag == "p":
+            self._vaciar()
+        elif tag in ("ul", "ol"):
+            self._vaciar()
+            inicio = dict(attrs).get("start") or "1"
+            self._listas.append([tag, int(inicio) if inicio.isdigit() else 1])
+        elif tag == "li":
+            self._vaciar()
+            if self._listas:
+                lista = self._listas[-1]
+                self._bullet = "•" if lista[0] == "ul" else f"{lista[1]}."
+                lista[1] += 1
+        elif tag == "table":
+            self._vaciar()
+            self._tabla = []
+        elif tag == "tr" and self._tabla is not None:
+            self._fila = []
+        elif tag in ("td", "th") and self._fila is not None:
+            self._texto = []
+            self._celda_cabecera = tag == "th"
+        elif tag == "hr":
+            from reportlab.platypus import HRFlowable
+
+            self._vaciar()
+            self.flowables.append(HRFlowable(width="100%", color="#999999", spaceBefore=4, spaceAfter=4))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in ("strong", "b"):
+            self._texto.append("</b>")
+        elif tag in ("em", "i"):
+            self._texto.append("</i>")
+        elif tag == "code":
+            self._texto.append("</font>")
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._vaciar()
+            self._estilo = "Normal"
+        elif tag in ("p", "li"):
+            self._vaciar()
+        elif tag in ("ul", "ol"):
+            self._vaciar()
+            if self._listas:
+                self._listas.pop()
+        elif tag in ("td", "th") and self._fila is not None:
+            self._vaciar()
+        elif tag == "tr" and self._fila is not None:
+            if self._fila:
+                self._tabla.append(self._fila)
+            self._fila = None
+        elif tag == "table" and self._tabla is not None:
+            self._agregar_tabla()
+
+    def handle_data(self, data):
+        self._texto.append(escape(data))
+
+    def _agregar_tabla(self):
+        from reportlab.platypus import Table, TableStyle
+
+        filas, self._tabla = self._tabla, None
+        if not filas:
+            return
+        columnas = max(len(fila) for fila in filas)
+        for fila in filas:
+            fila.extend([""] * (columnas - len(fila)))
+        tabla = Table(filas, colWidths=[self.ancho / columnas] * columnas, repeatRows=1, hAlign="LEFT")
+        tabla.setStyle(TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.5, "#bbbbbb"),
+            ("BACKGROUND", (0, 0), (-1, 0), "#e9f0f8"),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]))
+        self.flowables.append(tabla)
+
+    def close(self):
+        super().close()
+        self._vaciar()
+        if self._tabla is not None:
+            self._agregar_tabla()
+
+
+def render_pdf(contenido_html: str, titulo: str, subtitulo: str = "") -> bytes:
+    """Renderiza el HTML de un análisis a PDF. Se ejecuta en el pool de procesos."""
+    import io
+
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    base = getSampleStyleSheet()
+    estilos = {
+        "Normal": ParagraphStyle("Normal", parent=base["Normal"], fontSize=10, leading=14, spaceAfter=6),
+        "Titulo": ParagraphStyle("Titulo", parent=base["Heading3"], textColor="#0056b3"),
+        "Subtitulo": ParagraphStyle("Subtitulo", parent=base["Heading4"]),
+        "Celda": ParagraphStyle("Celda", parent=base["Normal"], fontSize=9, leading=11),
+        "CeldaCabecera": ParagraphStyle("CeldaCabecera", parent=base["Normal"], fontSize=9, leading=11,
+                                        fontName="Helvetica-Bold"),
+    }
+
+    buffer = io.BytesIO()
+    # invariant: sin fecha de creación ni id aleatorio, el mismo contenido da el mismo archivo.
+    doc = SimpleDocTemplate(
+        buffer, pagesize=A4, title=titulo, invariant=1,
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm,
+    )
+    parser = _HtmlAFlowables(estilos, doc.width)
+    parser.feed(contenido_html)
+    parser.close()
+
+    historia = [Paragraph(escape(titulo), base["Title"])]
+    if subtitulo:
+        historia.append(Paragraph(escape(subtitulo), base["Italic"]))
+    historia.append(Spacer(1, 0.5 * cm))
+    historia.extend(parser.flowables)
+
+    def pie(canvas, documento):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.drawRightString(A4[0] - 2 * cm, 1.2 * cm, f"Página {documento.page}")
+        canvas.restoreState()
+
+    doc.build(historia, onFirstPage=pie, onLaterPages=pie)
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def get_executor() -> ProcessPoolExecutor:
+    import multiprocessing
+
+    # spawn: los workers no heredan el estado del servidor (hilos, conexiones del pool).
+    return ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def shutdown():
+    if get_executor.cache_info().currsize:
+        get_executor().shutdown(wait=False, cancel_futures=True)
+        get_executor.cache_clear()
+
+
+async def _generar(ruta: str, contenido_html: str, titulo: str, subtitulo: str):
+    if os.path.exists(ruta):
+        return
+    loop = asyncio.get_running_loop()
+    datos = await loop.run_in_executor(get_executor(), render_pdf, contenido_html, titulo, subtitulo)
+    await asyncio.to_thread(_escribir_atomico, ruta, datos)
+    await asyncio.to_thread(_limpiar_si_toca)
+
+
+async def export_pdf(tipo: str, objeto_id: int, contenido_html: str, titulo: str,
+                     subtitulo: str = "") -> Tuple[str, str]:
+    """
+    Devuelve (ruta, versión) del PDF, renderizándolo solo si esa versión aún
+    no está guardada. Si la petición que lo estaba renderizando se cancela,
+    se reintenta una vez; si vuelve a pasar, se propaga `LiderCancelado`.
+    """
+    ver = version(contenido_html, titulo, subtitulo)
+    ruta = _ruta(tipo, objeto_id, ver, "pdf")
+    for intento in range(2):
+        # Usarlo lo protege de la limpieza mientras se sirve.
+        if await asyncio.to_thread(_marcar_uso, ruta):
+            break
+        try:
+            await _en_curso.do(ruta, lambda: _generar(ruta, contenido_html, titulo, subtitulo))
+            break
+        except LiderCancelado:
+            if intento:
+                raise
+    return ruta, ver
@@ -0,0 +1,85 @@
+"""
+Coalescencia de peticiones concurrentes duplicadas ("single flight").
+
+Cuando llegan a la vez dos peticiones con el mismo trabajo (doble clic, reintento
+del cliente), solo una lo ejecuta ("líder") y las demás esperan y reciben su
+resultado:
+
+  - `SingleFlight` coalesce dentro de un mismo proceso con un futuro por clave.
+  - `advisory_lock` serializa entre workers con un advisory lock de Postgres,
+    para que un worker que llega tarde espere al líder de otro proceso en vez
+    de repetir el trabajo.
+"""
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from sqlalchemy import text
+
+
+class LiderCancelado(Exception):
+    """La llamada que ejecutaba el trabajo se canceló (p. ej. su cliente se desconectó)."""
+
+
+class SingleFlight:
+    """Ejecuta una sola vez las llamadas concurrentes con la misma clave."""
+
+    def __init__(self):
+        self._en_curso: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, clave: Hashable, funcion: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Devuelve (resultado, compartido). `compartido` es True si el resultado
+        viene de otra llamada que ya estaba en curso. Los errores del líder se
+        propagan a todos los que esperaban; si el líder se cancela, reciben
+        `LiderCancelado` (su propia petición sigue viva y debe responder).
+        """
+        futuro = self._en_curso.get(clave)
+        if futuro is not None:
+            # shield: si este seguidor se cancela, el líder sigue su trabajo.
+            return await asyncio.shield(futuro), True
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_curso[clave] = futuro
+        try:
+            resultado = await funcion()
+        except asyncio.CancelledError:
+            futuro.set_exception(LiderCancelado())
+            futuro.exception()
+            raise
+        except BaseException as e:
+            futuro.set_exception(e)
+            # Marca la excepción como recuperada aunque no haya seguidores esperando.
+            futuro.exception()
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado, False
+        finally:
+            del self._en_curso[clave]
+
+
+def lock_key(texto: str) -> int:
+    """Convierte un texto (p. ej. un hash de archivo) en un entero de 32 bits con signo."""
+    return int.from_bytes(hashlib.sha256(texto.encode()).digest()[:4], "big", signed=True)
+
+
+@asynccontextmanager
+async def advisory_lock(db, clave1: int, clave2: int):
+    """
+    Mantiene `pg_advisory_xact_lock(clave1, clave2)` mientras dura el bloque.
+
+    El lock se toma en la transacción de la sesión `db` y no en otra conexión:
+    una petición que retuviera dos conexiones del pool a la vez lo agotaría con
+    muchas subidas concurrentes. Se libera con el primer commit dentro del
+    bloque (cuando el reporte ya es visible para quien espera) o al salir de él,
+    y también si se cierra la conexión, así que nunca queda retenido.
+    """
+    await asyncio.to_thread(db.execute, text("SELECT pg_advisory_xact_lock(:a, :b)"), {"a": clave1, "b": clave2})
+    try:
+        yield
+    except BaseException:
+        await asyncio.to_thread(db.rollback)
+        raise
+    await asyncio.to_thread(db.commit)
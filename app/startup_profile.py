@@ -0,0 +1,105 @@
+"""
+Perfil de arranque: mide cuánto cuesta importar la aplicación y construir
+sus clientes pesados.
+
+Uso:
+    python -m app.startup_profile                  # importación de app.main
+    python -m app.startup_profile --module rag     # importación de rag.py
+    python -m app.startup_profile --init           # además, coste de inicializar clientes
+
+La importación se mide en un proceso nuevo con `python -X importtime`, de modo
+que el resultado no depende de lo que ya esté cargado en este intérprete.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+
+def medir_importacion(modulo: str) -> dict:
+    """Importa `modulo` en un proceso limpio y agrega el coste por paquete raíz."""
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True,
+        text=True,
+    )
+    por_paquete = defaultdict(int)
+    total_us = 0
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "[us]" in linea:
+            continue
+        propio, nombre = _partir(linea)
+        por_paquete[nombre.split(".")[0]] += propio
+        total_us += propio
+
+    return {
+        "module": modulo,
+        "ok": proceso.returncode == 0,
+        "error": proceso.stderr.strip().splitlines()[-1] if proceso.returncode else None,
+        "total_ms": round(total_us / 1000, 2),
+        "packages_ms": {
+            paquete: round(us / 1000, 2)
+            for paquete, us in sorted(por_paquete.items(), key=lambda item: item[1], reverse=True)
+        },
+    }
+
+
+def _partir(linea: str):
+    # Formato: "import time: <self us> | <cumulative us> | <nombre indentado>"
+    propio, _, nombre = linea.split(":", 1)[1].split("|")
+    return int(propio), nombre.strip()
+
+
+def medir_inicializacion() -> dict:
+    """Mide el coste del primer uso de cada cliente perezoso de la aplicación."""
+    from app import rag_service
+    from app.api.utils import ia
+    from app.db import database
+
+    pasos = {
+        "rag_service.get_embeddings": rag_service.get_embeddings,
+        "rag_service.get_llm": rag_service.get_llm,
+        "ia.get_client": ia.get_client,
+        "database.engine.connect": lambda: database.engine.connect().close(),
+    }
+    resultados = {}
+    for nombre, paso in pasos.items():
+        inicio = time.perf_counter()
+        try:
+            paso()
+            resultados[nombre] = {"ms": round((time.perf_counter() - inicio) * 1000, 2)}
+        except Exception as e:
+            resultados[nombre] = {"ms": round((time.perf_counter() - inicio) * 1000, 2), "error": str(e)}
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfil de importación e inicialización en el arranque.")
+    parser.add_argument("--module", default="app.main", help="Módulo a importar (por defecto: app.main)")
+    parser.add_argument("--top", type=int, default=20, help="Número de paquetes a mostrar")
+    parser.add_argument("--init", action="store_true", help="Medir también la inicialización de clientes")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    args = parser.parse_args(argv)
+
+    informe = medir_importacion(args.module)
+    informe["packages_ms"] = dict(list(informe["packages_ms"].items())[: args.top])
+    if args.init:
+        informe["init"] = medir_inicializacion()
+
+    if args.json:
+        print(json.dumps(informe, indent=2))
+        return
+
+    estado = "ok" if informe["ok"] else f"ERROR: {informe['error']}"
+    print(f"Importación de {informe['module']}: {informe['total_ms']} ms ({estado})")
+    for paquete, ms in informe["packages_ms"].items():
+        print(f"  {paquete:<40} {ms:>10.2f} ms")
+    for nombre, dato in informe.get("init", {}).items():
+        extra = f"  ({dato['error']})" if "error" in dato else ""
+        print(f"  init {nombre:<35} {dato['ms']:>10.2f} ms{extra}")
+
+
+if __name__ == "__main__":
+    main()
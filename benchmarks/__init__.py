@@ -0,0 +1 @@
+# Initialize module
\ No newline at end of file
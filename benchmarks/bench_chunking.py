@@ -0,0 +1,88 @@
+"""
+Benchmark de chunking: RecursiveCharacterTextSplitter vs. LabReportSplitter.
+
+Para cada PDF se compara el número de chunks, los caracteres que se enviarían a
+embeddings, el texto duplicado por solapamiento y cuántas filas de resultados
+quedan partidas entre dos chunks (una fila partida no se puede recuperar entera).
+
+Uso:
+    python -m benchmarks.bench_chunking informe1.pdf informe2.pdf ...
+    python -m benchmarks.bench_chunking carpeta_con_pdfs/
+
+La calidad de recuperación se compara con benchmarks.bench_retrieval después de
+indexar los mismos documentos con cada divisor.
+"""
+import argparse
+import json
+import os
+import time
+
+
+def _pdfs(rutas):
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for nombre in sorted(os.listdir(ruta)):
+                if nombre.lower().endswith(".pdf"):
+                    yield os.path.join(ruta, nombre)
+        else:
+            yield ruta
+
+
+def medir(nombre, splitter, paginas_por_pdf):
+    from app.services.chunking import es_fila_de_tabla
+
+    chunks_totales = caracteres = caracteres_fuente = filas = filas_partidas = 0
+    inicio = time.perf_counter()
+    divididos = [splitter.split_documents(paginas) for paginas in paginas_por_pdf]
+    segundos = time.perf_counter() - inicio
+
+    for paginas, chunks in zip(paginas_por_pdf, divididos):
+        chunks_totales += len(chunks)
+        caracteres += sum(len(c.page_content) for c in chunks)
+        caracteres_fuente += sum(len(p.page_content) for p in paginas)
+        textos = [" ".join(c.page_content.split()) for c in chunks]
+        for pagina in paginas:
+            for linea in pagina.page_content.splitlines():
+                if es_fila_de_tabla(linea):
+                    filas += 1
+                    fila = " ".join(linea.split())
+                    if not any(fila in texto for texto in textos):
+                        filas_partidas += 1
+
+    return {
+        "splitter": nombre,
+        "chunks": chunks_totales,
+        "chunks_per_doc": round(chunks_totales / max(1, len(paginas_por_pdf)), 2),
+        "embedded_chars": caracteres,
+        "duplication_ratio": round(max(0, caracteres - caracteres_fuente) / max(1, caracteres_fuente), 4),
+        "table_rows": filas,
+        "table_rows_split": filas_partidas,
+        "split_ms": round(segundos * 1000, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+", help="PDFs o carpetas con PDFs")
+    parser.add_argument("--chunk-size", type=int, default=1500)
+    parser.add_argument("--chunk-overlap", type=int, default=200, help="Solapamiento del divisor actual")
+    args = parser.parse_args(argv)
+
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from app.services.chunking import LabReportSplitter
+
+    paginas_por_pdf = [PyPDFLoader(ruta).load() for ruta in _pdfs(args.rutas)]
+    resultados = [
+        medir(
+            f"RecursiveCharacterTextSplitter({args.chunk_size}, {args.chunk_overlap})",
+            RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap),
+            paginas_por_pdf,
+        ),
+        medir(f"LabReportSplitter({args.chunk_size})", LabReportSplitter(chunk_size=args.chunk_size), paginas_por_pdf),
+    ]
+    print(json.dumps({"documents": len(paginas_por_pdf), "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark del formateo de la respuesta del modelo: cadena anterior
+(formatear_mensaje + quitar_asteriscos) vs. app.api.utils.markdown.
+
+Mide el tiempo de CPU por reporte sobre respuestas sintéticas del tamaño
+indicado, y el renderizado incremental con fragmentos como los del streaming.
+Hay dos corpus: "prosa" (como las respuestas reales: párrafos y listas
+anidadas) y "tablas" (muchas tablas y listas cortas, el peor caso).
+
+Uso:
+    python -m benchmarks.bench_markdown
+    python -m benchmarks.bench_markdown --kb 8 32 128 --repeticiones 50
+    python -m benchmarks.bench_markdown --archivo respuesta.md
+"""
+import argparse
+import html
+import json
+import re
+import time
+
+_TABLAS = """## Resumen del análisis
+
+**Paciente:** Juan Pérez
+**Fecha:** 12/03/2024
+
+### Hemograma completo
+
+| Parámetro | Resultado | Rango de referencia | Interpretación |
+|---|---|---|---|
+| Hemoglobina | 13.2 g/dL | 13.5 - 17.5 | Ligeramente bajo |
+| Leucocitos | 7.800 /µL | 4.500 - 11.000 | Normal |
+| Plaquetas | 250.000 /µL | 150.000 - 450.000 | Normal |
+
+1. **Hemoglobina:** ligeramente por debajo del rango (<13.5 g/dL).
+    *   Puede indicar una anemia leve.
+    *   Se recomienda control en *tres meses*.
+2. **Leucocitos y plaquetas:** dentro de los valores normales.
+
+* Hidratación adecuada.
+* Dieta rica en hierro & vitamina C.
+
+---
+
+"""
+
+_PROSA = """Claro, aquí tienes el análisis de los resultados de laboratorio.
+
+1.  **Datos del Paciente:**
+    *   Nombre: Juan Pérez
+    *   Edad: 54 años
+    *   Género: Masculino
+
+2.  **Resultados del Examen:** La glucosa en ayunas es de 120 mg/dL (referencia: 70-100 mg/dL), lo que \
+indica un valor *ligeramente elevado*. El colesterol total es de 240 mg/dL (referencia: <200 mg/dL).
+
+3.  **Explicación de los Resultados:** La glucosa en sangre es un indicador importante para evaluar el \
+control de la diabetes. Un nivel de 120 mg/dL puede ser un signo de que los niveles de azúcar no están bien \
+controlados. El colesterol elevado aumenta el riesgo de enfermedades cardiovasculares.
+
+4.  **Recomendaciones Personalizadas:**
+    *   Reducir los carbohidratos simples (pan blanco, refrescos) y caminar 30 minutos al día.
+    *   Disminuir las grasas saturadas y añadir fibra: frutas, verduras y legumbres.
+
+Es importante recordar que esta interpretación es informativa y no sustituye una consulta médica profesional.
+
+"""
+
+
+def formatear_mensaje(mensaje: str) -> str:
+    # Copia de la cadena anterior de app/main.py, como referencia.
+    mensaje_escapado = html.escape(mensaje)
+    mensaje_destacado = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', mensaje_escapado)
+    mensaje_con_vinetas = re.sub(r'^\*\s+(.*)$', r'• \1', mensaje_destacado, flags=re.MULTILINE)
+    mensaje_formateado = mensaje_con_vinetas.replace("\n", "<br>")
+    return mensaje_formateado
+
+
+def quitar_asteriscos(mensaje: str) -> str:
+    return mensaje.replace("*", "•")
+
+
+def cadena_anterior(texto: str) -> str:
+    return quitar_asteriscos(formatear_mensaje(texto))
+
+
+def renderizado_incremental(texto: str, fragmento: int = 64) -> str:
+    from app.api.utils.markdown import MarkdownRenderer
+
+    renderer = MarkdownRenderer()
+    partes = [renderer.feed(texto[i:i + fragmento]) for i in range(0, len(texto), fragmento)]
+    partes.append(renderer.close())
+    return "".join(partes)
+
+
+def medir(funcion, texto: str, repeticiones: int) -> float:
+    """Milisegundos de CPU por reporte (mínimo de varias rondas)."""
+    mejor = float("inf")
+    for _ in range(5):
+        inicio = time.process_time()
+        for _ in range(repeticiones):
+            funcion(texto)
+        mejor = min(mejor, (time.process_time() - inicio) / repeticiones)
+    return round(mejor * 1000, 4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", type=int, nargs="+", default=[4, 16, 64, 256], help="Tamaños de respuesta (KB)")
+    parser.add_argument("--archivo", help="Usar una respuesta real del modelo en lugar de la sintética")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    from app.api.utils.markdown import render_markdown
+
+    if args.archivo:
+        with open(args.archivo, encoding="utf-8") as f:
+            textos = [(args.archivo, f.read())]
+    else:
+        textos = [
+            (nombre, bloque * max(1, kb * 1024 // len(bloque.encode())))
+            for nombre, bloque in (("prosa", _PROSA), ("tablas", _TABLAS))
+            for kb in args.kb
+        ]
+
+    resultados = []
+    for nombre, texto in textos:
+        resultados.append({
+            "corpus": nombre,
+            "kb": round(len(texto.encode()) / 1024, 1),
+            "anterior_ms": medir(cadena_anterior, texto, args.repeticiones),
+            "render_markdown_ms": medir(render_markdown, texto, args.repeticiones),
+            "incremental_ms": medir(renderizado_incremental, texto, args.repeticiones),
+        })
+    print(json.dumps({"results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
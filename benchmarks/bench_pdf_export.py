@@ -0,0 +1,105 @@
+"""
+Benchmark de la exportación a PDF (app.services.pdf_export).
+
+Mide, sobre análisis sintéticos y un directorio de exportación temporal:
+
+  - "inline": renderizar cada PDF en el propio proceso, uno tras otro (lo que
+    costaría generar el PDF en cada clic dentro del event loop),
+  - "pool": exportaciones distintas concurrentes en el pool de procesos,
+  - "cacheado": repetir las mismas exportaciones (solo comprueba el archivo),
+  - "coalescido": muchas peticiones simultáneas del mismo PDF; debe haber un
+    solo renderizado.
+
+Uso:
+    python -m benchmarks.bench_pdf_export
+    python -m benchmarks.bench_pdf_export --documentos 40 --concurrencia 16 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+
+def _documentos(n: int, repeticiones: int):
+    from app.api.utils.markdown import render_markdown
+    from benchmarks.bench_markdown import _PROSA, _TABLAS
+
+    # Cada documento es distinto (otra versión, otro archivo).
+    return [render_markdown(f"# Análisis {i}\n\n" + (_TABLAS + _PROSA) * repeticiones) for i in range(n)]
+
+
+async def _exportar_todos(documentos, concurrencia: int):
+    from app.services import pdf_export
+
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def uno(i, html):
+        async with semaforo:
+            await pdf_export.export_pdf("bench", i, html, "Resultados del Análisis")
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(uno(i, html) for i, html in enumerate(documentos)))
+    return time.perf_counter() - inicio
+
+
+async def _coalescido(html: str, peticiones: int):
+    from app.services import pdf_export
+
+    inicio = time.perf_counter()
+    rutas = await asyncio.gather(*(pdf_export.export_pdf("bench-coalescido", 0, html, "Resultados del Análisis")
+                                   for _ in range(peticiones)))
+    return time.perf_counter() - inicio, len({ruta for ruta, _ in rutas})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documentos", type=int, default=20)
+    parser.add_argument("--repeticiones", type=int, default=3, help="Tamaño de cada análisis (bloques de ejemplo)")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos del pool (por defecto EXPORT_WORKERS)")
+    args = parser.parse_args(argv)
+
+    from app.services import pdf_export
+
+    if args.workers:
+        pdf_export.EXPORT_WORKERS = args.workers
+    documentos = _documentos(args.documentos, args.repeticiones)
+    resultados = {"documentos": len(documentos), "workers": pdf_export.EXPORT_WORKERS}
+
+    with tempfile.TemporaryDirectory() as directorio:
+        pdf_export.EXPORT_DIR = directorio
+
+        inicio = time.perf_counter()
+        tamanos = [len(pdf_export.render_pdf(html, "Resultados del Análisis")) for html in documentos]
+        segundos = time.perf_counter() - inicio
+        resultados["kb_por_pdf"] = round(sum(tamanos) / len(tamanos) / 1024, 1)
+        resultados["inline"] = {"segundos": round(segundos, 3), "pdf_por_segundo": round(len(documentos) / segundos, 1)}
+
+        async def medir():
+            # Arranque del pool fuera de la medición.
+            await pdf_export.export_pdf("bench-arranque", 0, "<p>x</p>", "x")
+
+            segundos = await _exportar_todos(documentos, args.concurrencia)
+            resultados["pool"] = {"segundos": round(segundos, 3), "pdf_por_segundo": round(len(documentos) / segundos, 1)}
+
+            segundos = await _exportar_todos(documentos, args.concurrencia)
+            resultados["cacheado"] = {"segundos": round(segundos, 4),
+                                      "pdf_por_segundo": round(len(documentos) / segundos, 1)}
+
+            segundos, distintos = await _coalescido(documentos[0] + "<p>coalescido</p>", args.concurrencia * 4)
+            renderizados = len([n for n in os.listdir(directorio) if n.startswith("bench-coalescido")])
+            resultados["coalescido"] = {"peticiones": args.concurrencia * 4, "renderizados": renderizados,
+                                        "rutas_distintas": distintos, "segundos": round(segundos, 3)}
+
+        try:
+            asyncio.run(medir())
+        finally:
+            pdf_export.shutdown()
+
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark de recuperación: retriever vectorial actual vs. retriever híbrido.
+
+Para cada consulta se mide la latencia y el recall@k, entendido como la fracción
+de términos esperados (p. ej. "HbA1c", "TSH") que aparecen en algún chunk
+recuperado. Requiere una base de datos con la colección del usuario indexada.
+
+Uso:
+    python -m benchmarks.bench_retrieval --user-id 1
+    python -m benchmarks.bench_retrieval --user-id 1 --queries consultas.json --repeat 5
+
+El archivo de consultas es una lista JSON de objetos {"query": ..., "expected": [...]}.
+"""
+import argparse
+import json
+import statistics
+import time
+
+CONSULTAS_POR_DEFECTO = [
+    {"query": "hemoglobina glicosilada HbA1c", "expected": ["HbA1c"]},
+    {"query": "TSH hormona estimulante de tiroides", "expected": ["TSH"]},
+    {"query": "glucosa en ayunas mg/dL", "expected": ["glucosa"]},
+    {"query": "colesterol LDL HDL triglicéridos", "expected": ["colesterol", "triglicéridos"]},
+    {"query": "creatinina función renal", "expected": ["creatinina"]},
+    {"query": "hemograma hematocrito leucocitos plaquetas", "expected": ["hematocrito", "leucocitos", "plaquetas"]},
+    {"query": "Elabora un informe general consolidado basado en todos los documentos del historial.", "expected": []},
+]
+
+
+def recall(documentos, esperados) -> float:
+    if not esperados:
+        return 1.0
+    texto = " ".join(doc.page_content for doc in documentos).lower()
+    return sum(1 for termino in esperados if termino.lower() in texto) / len(esperados)
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def medir(nombre, retriever, consultas, repeticiones):
+    latencias, recalls = [], []
+    for consulta in consultas:
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            documentos = retriever.invoke(consulta["query"])
+            latencias.append((time.perf_counter() - inicio) * 1000)
+        recalls.append(recall(documentos, consulta["expected"]))
+    return {
+        "retriever": nombre,
+        "recall_at_k": round(statistics.mean(recalls), 4),
+        "latency_ms": {
+            "p50": round(percentil(latencias, 50), 2),
+            "p95": round(percentil(latencias, 95), 2),
+            "mean": round(statistics.mean(latencias), 2),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--queries", help="Archivo JSON con las consultas y términos esperados")
+    parser.add_argument("-k", type=int, default=15)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    from app import rag_service
+    from app.db import database
+    from app.services.hybrid_search import ensure_search_schema, MODES
+
+    consultas = CONSULTAS_POR_DEFECTO
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            consultas = json.load(f)
+
+    ensure_search_schema(database.engine)
+    retrievers = {
+        "actual (PGVector.as_retriever)": rag_service.get_vector_store_for_user(args.user_id).as_retriever(
+            search_kwargs={"k": args.k}
+        ),
+    }
+    for modo in MODES:
+        retrievers[f"hybrid_search ({modo})"] = rag_service.get_retriever_for_user(args.user_id, k=args.k, mode=modo)
+
+    # Calentamiento: conexiones del pool y cliente de embeddings.
+    for retriever in retrievers.values():
+        retriever.invoke(consultas[0]["query"])
+
+    resultados = [medir(nombre, r, consultas, args.repeat) for nombre, r in retrievers.items()]
+    print(json.dumps({"user_id": args.user_id, "k": args.k, "queries": len(consultas), "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Benchmark de la búsqueda en dos etapas del informe general.
+
+Crea un usuario sintético con historiales de distinto tamaño (reportes con sus
+chunks y el embedding de su análisis) y mide, para cada tamaño, el retriever
+del informe general en una etapa (todos los chunks del usuario) y en dos etapas
+(solo los chunks de los `--top-n` reportes más recientes o, con
+`--ranking relevance`, elegidos por el embedding del análisis y la recencia):
+
+  - latencia p50/p95 de la recuperación,
+  - chunks entre los que se busca (todos vs. los de los reportes elegidos),
+  - antigüedad (mediana y máxima, en días) de los reportes de los chunks que
+    llegan al contexto.
+
+Los embeddings son deterministas (DeterministicFakeEmbedding): se mide el coste
+en la base de datos, no la llamada a Gemini. Requiere DATABASE_URL con pgvector;
+el usuario y su colección se borran al terminar salvo con --conservar.
+
+Uso:
+    python -m benchmarks.bench_two_stage
+    python -m benchmarks.bench_two_stage --reportes 10 50 200 --chunks 40 --top-n 8 --repeat 20
+    python -m benchmarks.bench_two_stage --ranking relevance
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+CEDULA = "bench-two-stage"
+DIMENSION = 768
+ANALITOS = [
+    "glucosa", "HbA1c", "colesterol total", "colesterol LDL", "colesterol HDL", "triglicéridos", "TSH", "T4 libre",
+    "creatinina", "urea", "ácido úrico", "hemoglobina", "hematocrito", "leucocitos", "plaquetas", "ferritina",
+    "vitamina D", "vitamina B12", "ALT", "AST", "GGT", "fosfatasa alcalina", "sodio", "potasio", "PCR",
+]
+CONSULTA = "Elabora un informe general consolidado basado en todos los documentos del historial."
+
+
+def _chunk(rng: random.Random, reporte: int, indice: int) -> str:
+    analito = rng.choice(ANALITOS)
+    valor = round(rng.uniform(0.5, 250), 1)
+    return f"Reporte {reporte}, sección {indice}: {analito} {valor} mg/dL (referencia {round(valor * 0.8, 1)} - " \
+           f"{round(valor * 1.1, 1)}). Interpretación del resultado de {analito}."
+
+
+def _store(user_id: int, embeddings):
+    from langchain_postgres.vectorstores import PGVector
+
+    from app import rag_service
+
+    # Crea las tablas de langchain-postgres si la base de datos es nueva.
+    return PGVector(embeddings=embeddings, collection_name=f"user_{user_id}_reports",
+                    connection=rag_service.CONNECTION_STRING, use_jsonb=True)
+
+
+def _poblar(user_id: int, reportes: int, chunks: int, embeddings, semilla: int):
+    """Crea `reportes` reportes (repartidos en los últimos cinco años) con `chunks` chunks cada uno."""
+    from sqlalchemy import text
+
+    from app.db import database
+
+    rng = random.Random(semilla)
+    store = _store(user_id, embeddings)
+    with database.engine.begin() as conn:
+        for r in range(reportes):
+            file_hash = f"bench-{r:05d}"
+            textos = [_chunk(rng, r, i) for i in range(chunks)]
+            store.add_embeddings(
+                texts=textos,
+                embeddings=embeddings.embed_documents(textos),
+                metadatas=[{"user_id": user_id, "file_hash": file_hash}] * chunks,
+            )
+            conn.execute(text("""
+                INSERT INTO reports (report_content, user_id, file_hash, created_at, summary_embedding)
+                VALUES (:contenido, :user_id, :file_hash, now() - make_interval(days => :dias), CAST(:embedding AS vector))
+            """), {
+                "contenido": " ".join(textos[:5]), "user_id": user_id, "file_hash": file_hash,
+                "dias": rng.randint(0, 5 * 365), "embedding": str(embeddings.embed_query(" ".join(textos[:5]))),
+            })
+
+
+def _limpiar(user_id: int, embeddings):
+    from sqlalchemy import text
+
+    from app.db import database
+
+    _store(user_id, embeddings).delete_collection()
+    with database.engine.begin() as conn:
+        conn.execute(text("DELETE FROM reports WHERE user_id = :user_id"), {"user_id": user_id})
+
+
+def _chunks_candidatos(retriever, embedding) -> int:
+    """Chunks del usuario entre los que se busca (en dos etapas, solo los de los reportes elegidos)."""
+    from sqlalchemy import text
+
+    from app.db import database
+    from app.services.hybrid_search import COLLECTION_TABLE, EMBEDDING_TABLE, _filtro
+
+    hashes = retriever._reports(embedding) if retriever._dos_etapas else None
+    parametros = {"collection": retriever.collection_name}
+    if hashes is not None:
+        parametros["file_hashes"] = hashes
+    with database.engine.connect() as conn:
+        return conn.execute(text(f"""
+            SELECT count(*) FROM {EMBEDDING_TABLE} e JOIN {COLLECTION_TABLE} c ON c.uuid = e.collection_id
+            WHERE c.name = :collection {_filtro(file_hashes=hashes)}
+        """), parametros).scalar()
+
+
+def _antiguedad_contexto(retriever) -> dict:
+    """Antigüedad en días de los reportes de los chunks que devuelve el retriever."""
+    from sqlalchemy import text
+
+    from app.db import database
+
+    hashes = [doc.metadata.get("file_hash") for doc in retriever.invoke(CONSULTA)]
+    with database.engine.connect() as conn:
+        dias = dict(conn.execute(text("""
+            SELECT file_hash, extract(epoch FROM now() - created_at) / 86400.0 FROM reports
+            WHERE user_id = :user_id AND file_hash = ANY(:hashes)
+        """), {"user_id": retriever.user_id, "hashes": hashes}).all())
+    antiguedades = [float(dias[h]) for h in hashes if h in dias]
+    return {
+        "mediana": round(statistics.median(antiguedades)) if antiguedades else None,
+        "maxima": round(max(antiguedades)) if antiguedades else None,
+    }
+
+
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _medir(retriever, repeticiones: int):
+    retriever.invoke(CONSULTA)  # Calentamiento: conexiones del pool.
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        retriever.invoke(CONSULTA)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+    return {
+        "p50": round(_percentil(latencias, 50), 2),
+        "p95": round(_percentil(latencias, 95), 2),
+        "mean": round(statistics.mean(latencias), 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reportes", type=int, nargs="+", default=[10, 50, 200],
+                        help="Tamaños de historial (reportes por usuario)")
+    parser.add_argument("--chunks", type=int, default=30, help="Chunks por reporte")
+    parser.add_argument("--top-n", type=int, default=8, help="Reportes de la primera etapa")
+    parser.add_argument("--ranking", default="recency", choices=("recency", "relevance"),
+                        help="Cómo se eligen los reportes de la primera etapa")
+    parser.add_argument("--mode", default="hybrid")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--conservar", action="store_true", help="No borrar los datos sintéticos al terminar")
+    args = parser.parse_args(argv)
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    from app import crud
+    from app.db import database, schemas
+    from app.services.hybrid_search import HybridRetriever, ensure_search_schema
+
+    embeddings = DeterministicFakeEmbedding(size=DIMENSION)
+    db = database.SessionLocal()
+    try:
+        usuario = crud.get_user_by_cedula(db, cedula=CEDULA) or crud.create_user(
+            db, schemas.UserCreate(cedula=CEDULA, full_name="Benchmark dos etapas")
+        )
+        user_id = usuario.id
+    finally:
+        db.close()
+
+    resultados = []
+    try:
+        for reportes in args.reportes:
+            _limpiar(user_id, embeddings)
+            _poblar(user_id, reportes, args.chunks, embeddings, semilla=reportes)
+            ensure_search_schema(database.engine)
+            with database.engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE langchain_pg_embedding; ANALYZE reports")
+
+            fila = {"reportes": reportes, "chunks_totales": reportes * args.chunks}
+            embedding = embeddings.embed_query(CONSULTA)
+            for nombre, max_reports in (("una_etapa", None), ("dos_etapas", args.top_n)):
+                retriever = HybridRetriever(
+                    collection_name=f"user_{user_id}_reports", embeddings=embeddings, engine=database.engine,
+                    k=15, fetch_k=45, mode=args.mode, use_mmr=True, user_id=user_id, max_reports=max_reports,
+                    report_ranking=args.ranking,
+                )
+                fila[nombre] = {
+                    "chunks_candidatos": _chunks_candidatos(retriever, embedding),
+                    "antiguedad_contexto_dias": _antiguedad_contexto(retriever),
+                    "latency_ms": _medir(retriever, args.repeat),
+                }
+            resultados.append(fila)
+    finally:
+        if not args.conservar:
+            _limpiar(user_id, embeddings)
+
+    print(json.dumps({"chunks_por_reporte": args.chunks, "top_n": args.top_n, "ranking": args.ranking,
+                      "mode": args.mode,
+                      "results": resultados}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
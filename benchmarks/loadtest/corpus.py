@@ -0,0 +1,126 @@
+"""
+Corpus de PDFs de laboratorio sintéticos para las pruebas de carga.
+
+Cada PDF tiene el aspecto de un informe real: cabecera del laboratorio, datos
+del paciente y varios paneles (hemograma, química, lípidos, tiroides...) con
+resultado, unidad, rango de referencia y marca de fuera de rango. Los valores
+son aleatorios pero reproducibles (semilla), y cada archivo es distinto, así
+que no se coalescen ni se detectan como duplicados.
+
+Uso:
+    python -m benchmarks.loadtest.corpus --directorio /tmp/corpus --pdfs 50
+"""
+import argparse
+import os
+import random
+
+PANELES = {
+    "Hemograma completo": [
+        ("Hemoglobina", "g/dL", 13.5, 17.5), ("Hematocrito", "%", 41.0, 53.0),
+        ("Leucocitos", "x10³/µL", 4.5, 11.0), ("Plaquetas", "x10³/µL", 150.0, 450.0),
+        ("VCM", "fL", 80.0, 100.0), ("HCM", "pg", 27.0, 33.0),
+    ],
+    "Química sanguínea": [
+        ("Glucosa en ayunas", "mg/dL", 70.0, 100.0), ("HbA1c", "%", 4.0, 5.6),
+        ("Creatinina", "mg/dL", 0.7, 1.3), ("Urea", "mg/dL", 15.0, 45.0), ("Ácido úrico", "mg/dL", 3.4, 7.0),
+    ],
+    "Perfil lipídico": [
+        ("Colesterol total", "mg/dL", 0.0, 200.0), ("Colesterol LDL", "mg/dL", 0.0, 130.0),
+        ("Colesterol HDL", "mg/dL", 40.0, 60.0), ("Triglicéridos", "mg/dL", 0.0, 150.0),
+    ],
+    "Perfil tiroideo": [("TSH", "µUI/mL", 0.4, 4.0), ("T4 libre", "ng/dL", 0.8, 1.8)],
+    "Perfil hepático": [
+        ("ALT (TGP)", "U/L", 7.0, 56.0), ("AST (TGO)", "U/L", 10.0, 40.0),
+        ("GGT", "U/L", 9.0, 48.0), ("Fosfatasa alcalina", "U/L", 44.0, 147.0),
+    ],
+    "Electrolitos": [("Sodio", "mmol/L", 135.0, 145.0), ("Potasio", "mmol/L", 3.5, 5.1), ("Cloro", "mmol/L", 98.0, 107.0)],
+}
+NOMBRES = ["María", "José", "Ana", "Luis", "Carmen", "Carlos", "Rosa", "Pedro", "Lucía", "Jorge"]
+APELLIDOS = ["González", "Rodríguez", "Pérez", "Hernández", "García", "Martínez", "López", "Díaz", "Silva"]
+
+
+def paciente(indice: int) -> dict:
+    """Datos reproducibles del paciente simulado `indice` (la cédula es única)."""
+    rng = random.Random(f"paciente-{indice}")
+    return {
+        "cedula": f"LT-{indice:06d}",
+        "full_name": f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}",
+        "edad": rng.randint(18, 85),
+        "genero": rng.choice(["Femenino", "Masculino"]),
+    }
+
+
+def _valor(rng: random.Random, minimo: float, maximo: float) -> float:
+    # ~70 % dentro del rango; el resto algo por encima o por debajo.
+    ancho = (maximo - minimo) or maximo
+    if rng.random() < 0.7:
+        return round(rng.uniform(minimo, maximo), 1)
+    return round(max(0.1, rng.choice([minimo - ancho * rng.uniform(0.05, 0.4), maximo + ancho * rng.uniform(0.05, 0.6)])), 1)
+
+
+def generar_pdf(ruta: str, datos_paciente: dict, numero: int, semilla: str):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    rng = random.Random(semilla)
+    estilos = getSampleStyleSheet()
+    historia = [
+        Paragraph("Laboratorio Clínico Sintético, C.A.", estilos["Title"]),
+        Paragraph(f"Paciente: {datos_paciente['full_name']} &nbsp; C.I.: {datos_paciente['cedula']}", estilos["Normal"]),
+        Paragraph(f"Edad: {datos_paciente['edad']} años &nbsp; Género: {datos_paciente['genero']}", estilos["Normal"]),
+        Paragraph(f"Orden N.º {numero:05d} &nbsp; Fecha: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/"
+                  f"{rng.randint(2019, 2025)}", estilos["Normal"]),
+        Spacer(1, 0.5 * cm),
+    ]
+    for panel in rng.sample(sorted(PANELES), k=rng.randint(3, len(PANELES))):
+        filas = [["Prueba", "Resultado", "Unidad", "Referencia", ""]]
+        for nombre, unidad, minimo, maximo in PANELES[panel]:
+            valor = _valor(rng, minimo, maximo)
+            marca = "ALTO" if valor > maximo else "BAJO" if valor < minimo else ""
+            referencia = f"< {maximo:g}" if minimo == 0 else f"{minimo:g} - {maximo:g}"
+            filas.append([nombre, f"{valor:g}", unidad, referencia, marca])
+        tabla = Table(filas, colWidths=[5 * cm, 2.5 * cm, 2.5 * cm, 3.5 * cm, 1.5 * cm], hAlign="LEFT")
+        tabla.setStyle(TableStyle([("LINEBELOW", (0, 0), (-1, 0), 0.5, "#000000"),
+                                   ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold")]))
+        historia += [Paragraph(panel, estilos["Heading3"]), tabla, Spacer(1, 0.3 * cm)]
+    historia.append(Paragraph("Valores de referencia para adultos. Resultados validados por el bioanalista.",
+                              estilos["Italic"]))
+
+    SimpleDocTemplate(ruta, pagesize=A4, invariant=1).build(historia)
+
+
+def generar_corpus(directorio: str, pacientes: int, pdfs_por_paciente: int, semilla: int = 0) -> dict:
+    """
+    Genera (o reutiliza, si ya existen) los PDFs de cada paciente. Devuelve
+    {índice de paciente: [rutas]}.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    corpus = {}
+    for p in range(pacientes):
+        datos = paciente(p)
+        rutas = []
+        for n in range(pdfs_por_paciente):
+            ruta = os.path.join(directorio, f"{datos['cedula']}-{n:03d}-s{semilla}.pdf")
+            if not os.path.exists(ruta):
+                generar_pdf(ruta, datos, n, semilla=f"{semilla}-{p}-{n}")
+            rutas.append(ruta)
+        corpus[p] = rutas
+    return corpus
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directorio", required=True)
+    parser.add_argument("--pacientes", type=int, default=10)
+    parser.add_argument("--pdfs", type=int, default=3, help="PDFs por paciente")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    corpus = generar_corpus(args.directorio, args.pacientes, args.pdfs, args.semilla)
+    print(f"{sum(len(r) for r in corpus.values())} PDFs en {args.directorio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Simulador local de la API de Gemini para las pruebas de carga.
+
+Atiende las llamadas que hace la aplicación, con latencias configurables:
+
+  - HTTP (google-genai, app.api.utils.ia; se activa con GEMINI_BASE_URL):
+    subida reanudable de archivos, cachedContents (crear/renovar; rechaza con
+    400, como la API, las cachés por debajo de --cache-min-tokens) y
+    models/*:generateContent (con una caché expirada o desconocida responde
+    404, como la API).
+  - gRPC con TLS (clientes de LangChain de app.rag_service y rag.py; se activa
+    con GEMINI_API_ENDPOINT): GenerateContent, EmbedContent y
+    BatchEmbedContents. El cliente gRPC siempre usa TLS, así que se genera un
+    certificado autofirmado (requiere `openssl`) y el proceso cliente debe
+    confiar en él con GRPC_DEFAULT_SSL_ROOTS_FILE_PATH.
+
+Los embeddings son deterministas (dependen del texto), así que la búsqueda
+vectorial devuelve resultados estables. GET /stats devuelve cuántas llamadas
+recibió cada operación.
+
+Uso:
+    python -m benchmarks.loadtest.mock_gemini --latencia-generacion-ms 1500 --latencia-embeddings-ms 80
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from collections import Counter
+
+SERVICIO_GRPC = "google.ai.generativelanguage.v1beta.GenerativeService"
+DIMENSION = 768
+
+ANALISIS = """Claro, aquí tienes el análisis de los resultados de laboratorio.
+
+1.  **Datos del Paciente:**
+    *   Nombre: según el documento
+    *   Edad: según el documento
+
+2.  **Resultados del Examen:**
+
+| Parámetro | Resultado | Referencia | Interpretación |
+|---|---|---|---|
+| Glucosa en ayunas | 112 mg/dL | 70 - 100 | Ligeramente elevada |
+| Colesterol total | 214 mg/dL | < 200 | Elevado |
+| Hemoglobina | 14.1 g/dL | 13.5 - 17.5 | Normal |
+
+3.  **Explicación de los Resultados:** La glucosa en ayunas está *ligeramente elevada*; conviene repetir \
+la medición. El colesterol total supera el valor recomendado y aumenta el riesgo cardiovascular.
+
+4.  **Recomendaciones Personalizadas:**
+    *   Reducir los carbohidratos simples y caminar 30 minutos al día.
+    *   Aumentar el consumo de fibra: frutas, verduras y legumbres.
+
+Es importante recordar que esta interpretación es informativa y no sustituye una consulta médica profesional.
+"""
+
+INFORME_GENERAL = """## Resumen general
+
+El historial muestra **glucosa en ayunas** en el límite superior y **colesterol total** elevado de forma \
+repetida. El hemograma se mantiene dentro de los rangos de referencia.
+
+### Hallazgos recurrentes
+
+* Glucosa en ayunas entre 100 y 115 mg/dL.
+* Colesterol total por encima de 200 mg/dL.
+
+### Recomendaciones
+
+1. Control de glucosa y perfil lipídico en tres meses.
+2. Dieta baja en grasas saturadas y actividad física regular.
+"""
+
+
+class Latencia:
+    """Latencia en milisegundos con una variación uniforme de ±jitter (fracción)."""
+
+    def __init__(self, ms: float, jitter: float, rng: random.Random):
+        self.ms, self.jitter, self.rng = ms, jitter, rng
+
+    async def esperar(self):
+        if self.ms > 0:
+            await asyncio.sleep(self.ms * (1 + self.rng.uniform(-self.jitter, self.jitter)) / 1000)
+
+
+def embedding(texto: str):
+    """Vector unitario determinista para el texto."""
+    rng = random.Random(hashlib.sha256(texto.encode()).digest())
+    vector = [rng.gauss(0, 1) for _ in range(DIMENSION)]
+    norma = sum(x * x for x in vector) ** 0.5
+    return [x / norma for x in vector]
+
+
+def certificado_autofirmado(directorio: str):
+    """Genera (cert, clave) para localhost con openssl. Devuelve sus rutas."""
+    os.makedirs(directorio, exist_ok=True)
+    cert, clave = os.path.join(directorio, "mock-gemini.crt"), os.path.join(directorio, "mock-gemini.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2", "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1", "-keyout", clave, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, clave
+
+
+def _segundos(ttl) -> float:
+    """TTL de la API ("3600s"); sin TTL, una hora, como la API."""
+    return float(ttl.rstrip("s")) if ttl else 3600.0
+
+
+def _no_encontrada(web, cache: str):
+    return web.json_response({"error": {
+        "code": 404, "status": "NOT_FOUND", "message": f"CachedContent not found (or permission denied): {cache}",
+    }}, status=404)
+
+
+class MockGemini:
+    def __init__(self, generacion: Latencia, embeddings: Latencia, subida: Latencia, cache_min_tokens: int = 32768):
+        self.generacion, self.embeddings, self.subida = generacion, embeddings, subida
+        self.cache_min_tokens = cache_min_tokens
+        self.llamadas = Counter()
+        self._ids = itertools.count(1)
+        # Nombre de cada caché -> instante (time.monotonic) en que expira.
+        self._caches = {}
+
+    # --- HTTP (google-genai) ---
+
+    def aplicacion_http(self, base_url: str):
+        from aiohttp import web
+
+        async def iniciar_subida(request):
+            self.llamadas["files.upload"] += 1
+            await request.read()
+            archivo = f"files/mock-{next(self._ids)}"
+            return web.json_response({}, headers={"X-Goog-Upload-URL": f"{base_url}/upload-session/{archivo}"})
+
+        async def subir(request):
+            await request.read()
+            await self.subida.esperar()
+            archivo = "files/" + request.match_info["archivo"]
+            return web.json_response(
+                {"file": {"name": archivo, "uri": f"{base_url}/v1beta/{archivo}", "mimeType": "application/pdf",
+                          "state": "ACTIVE"}},
+                headers={"X-Goog-Upload-Status": "final"},
+            )
+
+        async def crear_cache(request):
+            self.llamadas["cachedContents.create"] += 1
+            cuerpo = await request.json()
+            # Como la API: una caché explícita por debajo del mínimo del modelo es un 400.
+            tokens = sum(len(parte.get("text", "")) for contenido in cuerpo.get("contents", [])
+                         for parte in contenido.get("parts", [])) // 4
+            if tokens < self.cache_min_tokens:
+                self.llamadas["cachedContents.rechazadas"] += 1
+                return web.json_response({"error": {
+                    "code": 400, "status": "INVALID_ARGUMENT",
+                    "message": f"Cached content is too small. total_token_count={tokens}, "
+                               f"min_total_token_count={self.cache_min_tokens}",
+                }}, status=400)
+            nombre = f"cachedContents/mock-{next(self._ids)}"
+            self._caches[nombre] = time.monotonic() + _segundos(cuerpo.get("ttl"))
+            return web.json_response({"name": nombre, "model": "models/mock"})
+
+        async def renovar_cache(request):
+            self.llamadas["cachedContents.update"] += 1
+            cuerpo = await request.json()
+            nombre = f"cachedContents/{request.match_info['cache']}"
+            if time.monotonic() >= self._caches.get(nombre, 0):
+                return _no_encontrada(web, nombre)
+            self._caches[nombre] = time.monotonic() + _segundos(cuerpo.get("ttl"))
+            return web.json_response({"name": nombre})
+
+        async def generar(request):
+            self.llamadas["generateContent"] += 1
+            cuerpo = await request.json()
+            cache = cuerpo.get("cachedContent")
+            if cache and time.monotonic() >= self._caches.get(cache, 0):
+                self.llamadas["generateContent.cache_expirada"] += 1
+                return _no_encontrada(web, cache)
+            await self.generacion.esperar()
+            return web.json_response({
+                "candidates": [{"content": {"role": "model", "parts": [{"text": ANALISIS}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": 1200, "candidatesTokenCount": 450, "totalTokenCount": 1650},
+            })
+
+        async def estadisticas(request):
+            return web.json_response(dict(self.llamadas))
+
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post("/upload/v1beta/files", iniciar_subida),
+            web.post("/upload-session/files/{archivo}", subir),
+            web.post("/v1beta/cachedContents", crear_cache),
+            web.patch("/v1beta/cachedContents/{cache}", renovar_cache),
+            web.post(r"/v1beta/models/{modelo}:generateContent", generar),
+            web.get("/stats", estadisticas),
+        ])
+        return app
+
+    # --- gRPC (LangChain) ---
+
+    def manejadores_grpc(self):
+        import grpc
+        from google.ai.generativelanguage_v1beta import types
+
+        async def generar(request, context):
+            self.llamadas["grpc.GenerateContent"] += 1
+            await self.generacion.esperar()
+            return types.GenerateContentResponse(candidates=[types.Candidate(
+                content=types.Content(role="model", parts=[types.Part(text=INFORME_GENERAL)]),
+                finish_reason=types.Candidate.FinishReason.STOP,
+            )], usage_metadata=types.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=3000, candidates_token_count=300, total_token_count=3300,
+            ))
+
+        async def embeber(request, context):
+            self.llamadas["grpc.EmbedContent"] += 1
+            await self.embeddings.esperar()
+            texto = " ".join(parte.text for parte in request.content.parts)
+            return types.EmbedContentResponse(embedding=types.ContentEmbedding(values=embedding(texto)))
+
+        async def embeber_lote(request, context):
+            self.llamadas["grpc.BatchEmbedContents"] += 1
+            self.llamadas["grpc.textos_embebidos"] += len(request.requests)
+            await self.embeddings.esperar()
+            return types.BatchEmbedContentsResponse(embeddings=[
+                types.ContentEmbedding(values=embedding(" ".join(p.text for p in r.content.parts)))
+                for r in request.requests
+            ])
+
+        def unario(funcion, peticion, respuesta):
+            return grpc.unary_unary_rpc_method_handler(
+                funcion, request_deserializer=peticion.deserialize, response_serializer=respuesta.serialize
+            )
+
+        return grpc.method_handlers_generic_handler(SERVICIO_GRPC, {
+            "GenerateContent": unario(generar, types.GenerateContentRequest, types.GenerateContentResponse),
+            "EmbedContent": unario(embeber, types.EmbedContentRequest, types.EmbedContentResponse),
+            "BatchEmbedContents": unario(embeber_lote, types.BatchEmbedContentsRequest,
+                                         types.BatchEmbedContentsResponse),
+        })
+
+    async def servir(self, host: str, puerto_http: int, puerto_grpc: int, cert: str, clave: str):
+        import grpc
+        from aiohttp import web
+
+        runner = web.AppRunner(self.aplicacion_http(f"http://{host}:{puerto_http}"), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, puerto_http).start()
+
+        with open(cert, "rb") as f_cert, open(clave, "rb") as f_clave:
+            credenciales = grpc.ssl_server_credentials([(f_clave.read(), f_cert.read())])
+        servidor = grpc.aio.server()
+        servidor.add_generic_rpc_handlers((self.manejadores_grpc(),))
+        servidor.add_secure_port(f"{host}:{puerto_grpc}", credenciales)
+        await servidor.start()
+        try:
+            await servidor.wait_for_termination()
+        finally:
+            await runner.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto-http", type=int, default=8790)
+    parser.add_argument("--puerto-grpc", type=int, default=8791)
+    parser.add_argument("--latencia-generacion-ms", type=float, default=1500)
+    parser.add_argument("--latencia-embeddings-ms", type=float, default=80)
+    parser.add_argument("--latencia-subida-ms", type=float, default=150)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Variación de las latencias (fracción)")
+    parser.add_argument("--cache-min-tokens", type=int, default=32768,
+                        help="Tamaño mínimo de una caché de contexto (el de gemini-2.0-flash-001)")
+    parser.add_argument("--directorio-cert", help="Dónde generar el certificado (por defecto, un temporal)")
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.semilla)
+    mock = MockGemini(
+        Latencia(args.latencia_generacion_ms, args.jitter, rng),
+        Latencia(args.latencia_embeddings_ms, args.jitter, rng),
+        Latencia(args.latencia_subida_ms, args.jitter, rng),
+        args.cache_min_tokens,
+    )
+    directorio = args.directorio_cert or tempfile.mkdtemp(prefix="mock-gemini-")
+    cert, clave = certificado_autofirmado(directorio)
+    # Variables de entorno con las que se lanza la aplicación contra el simulador.
+    print(json.dumps({
+        "GEMINI_BASE_URL": f"http://{args.host}:{args.puerto_http}",
+        "GEMINI_API_ENDPOINT": f"localhost:{args.puerto_grpc}",
+        "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": cert,
+    }), flush=True)
+    asyncio.run(mock.servir(args.host, args.puerto_http, args.puerto_grpc, cert, clave))
+
+
+if __name__ == "__main__":
+    main()
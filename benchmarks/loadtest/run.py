@@ -0,0 +1,403 @@
+"""
+Prueba de carga de extremo a extremo, sin dependencias externas salvo PostgreSQL.
+
+Levanta el simulador de Gemini (benchmarks.loadtest.mock_gemini), la
+aplicación (app.main) y la API RAG (rag.py) con uvicorn contra la base de datos
+de DATABASE_URL (PostgreSQL con pgvector), genera el corpus de PDFs sintéticos
+y lanza N pacientes simulados a la vez. Cada paciente:
+
+  1. se registra (/register-user/),
+  2. sube sus PDFs uno tras otro (/medical-report/) y abre cada resultado,
+  3. consulta su historial (/get-reports/),
+  4. pide el informe general (/generate-general-report/),
+  5. en rag.py sube un PDF (/subir-pdf) y hace preguntas (/preguntar).
+
+Al terminar imprime (y guarda con --salida) un JSON con la latencia
+p50/p95/p99 por endpoint, los errores, el throughput, las conexiones a la base
+de datos (pg_stat_activity) y el pico de memoria (RSS) de cada servidor, para
+compararlo entre versiones.
+
+rag.py usa su propia colección (RAG_COLLECTION_NAME=loadtest_grados_uni). Al
+empezar se migra la base de datos y se borran los usuarios de la prueba
+(cédulas "LT-...") con sus datos y esa colección. Por eso la prueba se niega a
+ejecutarse si la base de datos tiene otros usuarios u otras colecciones: debe
+ser una base de datos solo para pruebas.
+
+Uso:
+    DATABASE_URL=postgresql+psycopg://... python -m benchmarks.loadtest.run --pacientes 20
+    python -m benchmarks.loadtest.run --pacientes 50 --pdfs 3 --latencia-generacion-ms 3000 --salida carga.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RAG_COLLECTION = "loadtest_grados_uni"
+PREGUNTAS = [
+    "¿Qué valores de glucosa aparecen en los informes?",
+    "¿El colesterol total está dentro del rango de referencia?",
+    "¿Hay algún resultado del hemograma fuera de rango?",
+]
+
+
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+class Metricas:
+    """Latencias y códigos de estado por endpoint."""
+
+    def __init__(self):
+        self.latencias = defaultdict(list)
+        self.estados = defaultdict(Counter)
+        self.errores = Counter()
+
+    async def medir(self, nombre: str, peticion):
+        inicio = time.perf_counter()
+        try:
+            respuesta = await peticion
+        except Exception as e:
+            self.estados[nombre][type(e).__name__] += 1
+            self.errores[f"{nombre}: {type(e).__name__}"] += 1
+            return None
+        self.latencias[nombre].append((time.perf_counter() - inicio) * 1000)
+        self.estados[nombre][str(respuesta.status_code)] += 1
+        if respuesta.status_code >= 400:
+            self.errores[f"{nombre}: {respuesta.status_code} {respuesta.text[:120]}"] += 1
+        return respuesta
+
+    def resumen(self):
+        endpoints = {}
+        for nombre, latencias in sorted(self.latencias.items()):
+            endpoints[nombre] = {
+                "peticiones": len(latencias),
+                "estados": dict(self.estados[nombre]),
+                "latency_ms": {
+                    "p50": round(_percentil(latencias, 50), 1),
+                    "p95": round(_percentil(latencias, 95), 1),
+                    "p99": round(_percentil(latencias, 99), 1),
+                    "mean": round(statistics.mean(latencias), 1),
+                    "max": round(max(latencias), 1),
+                },
+            }
+        # Endpoints en los que todas las peticiones fallaron antes de responder.
+        for nombre, estados in self.estados.items():
+            endpoints.setdefault(nombre, {"peticiones": 0, "estados": dict(estados)})
+        return endpoints
+
+
+# --- Procesos ---
+
+def _iniciar(argumentos, env, log):
+    return subprocess.Popen([sys.executable, *argumentos], cwd=RAIZ, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def _iniciar_mock(args, directorio, log):
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.loadtest.mock_gemini", "--puerto-http", str(args.puerto_mock),
+         "--puerto-grpc", str(args.puerto_mock + 1), "--directorio-cert", directorio,
+         "--latencia-generacion-ms", str(args.latencia_generacion_ms),
+         "--latencia-embeddings-ms", str(args.latencia_embeddings_ms),
+         "--latencia-subida-ms", str(args.latencia_subida_ms), "--jitter", str(args.jitter)],
+        cwd=RAIZ, stdout=subprocess.PIPE, stderr=log, text=True,
+    )
+    # La primera línea son las variables de entorno para apuntar la aplicación al simulador.
+    linea = proceso.stdout.readline()
+    if not linea:
+        raise RuntimeError(f"El simulador de Gemini no arrancó (código {proceso.wait()}).")
+    return proceso, json.loads(linea)
+
+
+async def _esperar(cliente, url: str, proceso, segundos: float = 90):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El servidor de {url} terminó al arrancar (código {proceso.returncode}).")
+        try:
+            if (await cliente.get(url)).status_code < 500:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.3)
+    raise TimeoutError(f"{url} no respondió en {segundos:.0f} s.")
+
+
+def _datos_ajenos(database_url: str):
+    """
+    Describe los datos que no son de la prueba (usuarios sin cédula LT-... o
+    colecciones que no son suyas) o devuelve None si no hay ninguno.
+    """
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            usuarios = 0
+            if conn.execute(text("SELECT to_regclass('users')")).scalar() is not None:
+                usuarios = conn.execute(text("SELECT count(*) FROM users WHERE cedula NOT LIKE 'LT-%'")).scalar()
+            colecciones = []
+            if conn.execute(text("SELECT to_regclass('langchain_pg_collection')")).scalar() is not None:
+                colecciones = conn.execute(text("""
+                    SELECT name FROM langchain_pg_collection
+                    WHERE name <> :rag AND name NOT IN (
+                        SELECT 'user_' || id || '_reports' FROM users WHERE cedula LIKE 'LT-%'
+                    )
+                    ORDER BY name LIMIT 5
+                """), {"rag": RAG_COLLECTION}).scalars().all()
+    finally:
+        engine.dispose()
+    if not usuarios and not colecciones:
+        return None
+    return f"{usuarios} usuarios ajenos a la prueba, colecciones: {', '.join(colecciones) or 'ninguna'}"
+
+
+def _limpiar_datos(database_url: str):
+    """Borra los usuarios de pruebas anteriores (cédulas LT-...), sus reportes y sus colecciones."""
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        ids = [fila[0] for fila in conn.execute(text("SELECT id FROM users WHERE cedula LIKE 'LT-%'"))]
+        if conn.execute(text("SELECT to_regclass('langchain_pg_collection')")).scalar() is not None:
+            conn.execute(text("DELETE FROM langchain_pg_collection WHERE name = ANY(:nombres)"),
+                         {"nombres": [f"user_{i}_reports" for i in ids] + [RAG_COLLECTION]})
+        conn.execute(text("DELETE FROM reports WHERE user_id = ANY(:ids)"), {"ids": ids})
+        conn.execute(text("DELETE FROM users WHERE id = ANY(:ids)"), {"ids": ids})
+    engine.dispose()
+
+
+# --- Muestreo de recursos ---
+
+async def _muestrear(database_url: str, procesos: dict, muestras: dict, parar: asyncio.Event, intervalo: float):
+    import psutil
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(database_url, pool_size=1)
+    consulta = text("""
+        SELECT count(*), count(*) FILTER (WHERE state = 'active')
+        FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()
+    """)
+
+    def muestra():
+        with engine.connect() as conn:
+            total, activas = conn.execute(consulta).one()
+        muestras["conexiones"].append(total)
+        muestras["conexiones_activas"].append(activas)
+        for nombre, proceso in procesos.items():
+            try:
+                raiz = psutil.Process(proceso.pid)
+                # Con --workers, uvicorn lanza un proceso por worker.
+                rss = sum(p.memory_info().rss for p in [raiz, *raiz.children(recursive=True)])
+            except psutil.Error:
+                continue
+            muestras[f"rss_{nombre}"].append(rss / 2 ** 20)
+
+    with engine.connect() as conn:
+        muestras["max_connections"] = int(conn.execute(text("SHOW max_connections")).scalar())
+    while not parar.is_set():
+        await asyncio.to_thread(muestra)
+        try:
+            await asyncio.wait_for(parar.wait(), intervalo)
+        except asyncio.TimeoutError:
+            pass
+    engine.dispose()
+
+
+# --- Pacientes simulados ---
+
+async def _paciente(cliente, url_app: str, url_rag, indice: int, rutas, preguntas: int, metricas: Metricas,
+                    retraso: float):
+    from benchmarks.loadtest.corpus import paciente
+
+    await asyncio.sleep(retraso)
+    datos = paciente(indice)
+    cedula = datos["cedula"]
+    respuesta = await metricas.medir("/register-user/", cliente.post(
+        f"{url_app}/register-user/", json={"cedula": cedula, "full_name": datos["full_name"]}
+    ))
+    if respuesta is None or respuesta.status_code != 200:
+        return False
+
+    ok = True
+    for ruta in rutas:
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        respuesta = await metricas.medir("/medical-report/", cliente.post(
+            f"{url_app}/medical-report/", data={"cedula": cedula},
+            files={"file": (os.path.basename(ruta), contenido, "application/pdf")},
+        ))
+        if respuesta is None or respuesta.status_code != 200:
+            ok = False
+            continue
+        await metricas.medir("/resultados/{id}", cliente.get(url_app + respuesta.json()["redirect_url"]))
+
+    await metricas.medir("/get-reports/", cliente.post(f"{url_app}/get-reports/", json={"cedula": cedula}))
+    respuesta = await metricas.medir("/generate-general-report/", cliente.post(
+        f"{url_app}/generate-general-report/", json={"cedula": cedula}
+    ))
+    ok = ok and respuesta is not None and respuesta.status_code == 200
+
+    if url_rag:
+        with open(rutas[0], "rb") as f:
+            contenido = f.read()
+        respuesta = await metricas.medir("rag /subir-pdf", cliente.post(
+            f"{url_rag}/subir-pdf", files={"file": (os.path.basename(rutas[0]), contenido, "application/pdf")},
+        ))
+        ok = ok and respuesta is not None and respuesta.status_code == 200
+        for n in range(preguntas):
+            respuesta = await metricas.medir("rag /preguntar", cliente.post(
+                f"{url_rag}/preguntar", json={"pregunta": PREGUNTAS[n % len(PREGUNTAS)]}
+            ))
+            ok = ok and respuesta is not None and respuesta.status_code == 200
+    return ok
+
+
+async def _ejecutar(args, env, corpus, procesos):
+    import httpx
+
+    url_app = f"http://127.0.0.1:{args.puerto_app}"
+    url_rag = None if args.sin_rag else f"http://127.0.0.1:{args.puerto_app + 1}"
+    metricas = Metricas()
+    muestras = defaultdict(list)
+    parar = asyncio.Event()
+
+    limites = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limites) as cliente:
+        await _esperar(cliente, f"{url_app}/ping", procesos["app"])
+        if url_rag:
+            await _esperar(cliente, f"{url_rag}/", procesos["rag"])
+
+        muestreo = asyncio.create_task(_muestrear(env["DATABASE_URL"], procesos, muestras, parar, args.muestreo_s))
+        inicio = time.perf_counter()
+        resultados = await asyncio.gather(*(
+            _paciente(cliente, url_app, url_rag, p, corpus[p], args.preguntas, metricas,
+                      retraso=args.rampa_s * p / max(1, args.pacientes))
+            for p in range(args.pacientes)
+        ))
+        duracion = time.perf_counter() - inicio
+        parar.set()
+        await muestreo
+
+        try:
+            llamadas_gemini = (await cliente.get(f"{env['GEMINI_BASE_URL']}/stats")).json()
+        except Exception:
+            llamadas_gemini = None
+
+    peticiones = sum(len(v) for v in metricas.latencias.values())
+    return {
+        "duracion_s": round(duracion, 2),
+        "pacientes": {"total": args.pacientes, "completos": sum(resultados),
+                      "por_minuto": round(sum(resultados) / duracion * 60, 1)},
+        "throughput_rps": round(peticiones / duracion, 2),
+        "endpoints": metricas.resumen(),
+        "errores": dict(metricas.errores.most_common(20)),
+        "db_conexiones": {
+            "max": max(muestras["conexiones"], default=None),
+            "max_activas": max(muestras["conexiones_activas"], default=None),
+            "media": round(statistics.mean(muestras["conexiones"]), 1) if muestras["conexiones"] else None,
+            "max_connections": muestras.get("max_connections"),
+        },
+        "rss_pico_mb": {nombre: round(max(muestras[f"rss_{nombre}"]), 1)
+                        for nombre in procesos if muestras[f"rss_{nombre}"]},
+        "llamadas_gemini": llamadas_gemini,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pacientes", type=int, default=10, help="Pacientes simulados concurrentes")
+    parser.add_argument("--pdfs", type=int, default=2, help="PDFs que sube cada paciente")
+    parser.add_argument("--preguntas", type=int, default=2, help="Preguntas a rag.py por paciente")
+    parser.add_argument("--rampa-s", type=float, default=0, help="Segundos en los que se reparten los inicios")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de uvicorn de app.main")
+    parser.add_argument("--sin-rag", action="store_true", help="No levantar ni probar rag.py")
+    parser.add_argument("--latencia-generacion-ms", type=float, default=1500)
+    parser.add_argument("--latencia-embeddings-ms", type=float, default=80)
+    parser.add_argument("--latencia-subida-ms", type=float, default=150)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--puerto-app", type=int, default=8800, help="app.main; rag.py usa el siguiente")
+    parser.add_argument("--puerto-mock", type=int, default=8790, help="HTTP del simulador; gRPC usa el siguiente")
+    parser.add_argument("--corpus", help="Directorio del corpus (por defecto, uno temporal)")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300, help="Timeout de cada petición (s)")
+    parser.add_argument("--muestreo-s", type=float, default=0.5, help="Intervalo de muestreo de conexiones y RSS")
+    parser.add_argument("--sin-migrar", action="store_true", help="No ejecutar `alembic upgrade head`")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el resultado")
+    args = parser.parse_args(argv)
+
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        parser.error("DATABASE_URL no está configurada (PostgreSQL con pgvector).")
+    if database_url.startswith("postgresql://"):
+        database_url = database_url.replace("postgresql://", "postgresql+psycopg://", 1)
+
+    # La prueba migra la base de datos y borra datos: solo contra una base de
+    # datos vacía o con datos de pruebas anteriores.
+    ajenos = _datos_ajenos(database_url)
+    if ajenos:
+        parser.error(f"DATABASE_URL no parece una base de datos de pruebas ({ajenos}). "
+                     "Usa una base de datos dedicada a la prueba de carga.")
+
+    from benchmarks.loadtest.corpus import generar_corpus
+
+    directorio = tempfile.mkdtemp(prefix="loadtest-")
+    corpus = generar_corpus(args.corpus or os.path.join(directorio, "corpus"), args.pacientes, args.pdfs,
+                            args.semilla)
+
+    if not args.sin_migrar:
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], cwd=RAIZ, check=True,
+                       env={**os.environ, "DATABASE_URL": database_url}, capture_output=True)
+    _limpiar_datos(database_url)
+
+    # Con SIGTERM (p. ej. `timeout`) se sale por el `finally` y se paran los servidores.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+    procesos = {}
+    with open(os.path.join(directorio, "servidores.log"), "wb") as log:
+        mock, env_mock = _iniciar_mock(args, os.path.join(directorio, "cert"), log)
+        env = {
+            **os.environ, **env_mock,
+            "DATABASE_URL": database_url,
+            "GEMINI_API_KEY": os.getenv("GEMINI_API_KEY", "loadtest"),
+            "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY", "loadtest"),
+            "EXPORT_DIR": os.path.join(directorio, "exports"),
+            "RAG_COLLECTION_NAME": RAG_COLLECTION,
+        }
+        try:
+            procesos["app"] = _iniciar(["-m", "uvicorn", "app.main:app", "--port", str(args.puerto_app),
+                                        "--workers", str(args.workers), "--log-level", "warning"], env, log)
+            if not args.sin_rag:
+                procesos["rag"] = _iniciar(["-m", "uvicorn", "rag:app", "--port", str(args.puerto_app + 1),
+                                            "--log-level", "warning"], env, log)
+            resultado = asyncio.run(_ejecutar(args, env, corpus, procesos))
+        finally:
+            for proceso in [*procesos.values(), mock]:
+                proceso.terminate()
+            for proceso in [*procesos.values(), mock]:
+                try:
+                    proceso.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proceso.kill()
+
+    resultado = {
+        "config": {clave: valor for clave, valor in vars(args).items() if clave not in ("salida", "corpus")},
+        "logs": os.path.join(directorio, "servidores.log"),
+        **resultado,
+    }
+    salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(salida + "\n")
+    print(salida)
+
+
+if __name__ == "__main__":
+    main()
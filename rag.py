@@ -1,5 +1,7 @@
+import asyncio
 import os
 import tempfile
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # --- Dependencias de FastAPI ---
@@ -8,13 +10,8 @@ from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
 # --- Dependencias de LangChain ---
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader # <-- Cargador de PDFs
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_postgres.vectorstores import PGVector # <-- ¡El nuevo Vector Store!
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
+# Se importan dentro de las funciones que las usan: son costosas de cargar y
+# así el arranque del servidor no depende de ellas ni de la base de datos.
 
 # -----------------------------------------------------------------------------
 # 1. CONFIGURACIÓN INICIAL
@@ -46,35 +43,68 @@ app.add_middleware(
 # 2. LÓGICA DEL RAG (AHORA CONECTADO A SUPABASE)
 # -----------------------------------------------------------------------------
 
-# El nombre de la colección (tabla) en nuestra base de datos vectorial
-COLLECTION_NAME = "grados_uni"
-
-# Modelo de Embeddings
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# El nombre de la colección (tabla) en nuestra base de datos vectorial. La
+# prueba de carga usa otra para no tocar la real.
+COLLECTION_NAME = os.getenv("RAG_COLLECTION_NAME", "grados_uni")
 
 # URL de conexión a la base de datos (leída desde .env)
 connection = os.getenv("DATABASE_URL")
 
-# Inicializamos el Vector Store conectándonos a nuestra tabla existente.
-# Usamos PGVector.from_existing_index para esto.
-vector_store = PGVector.from_existing_index(
-    embedding=embeddings,                   # El modelo de embeddings que usamos
-    collection_name=COLLECTION_NAME,        # El nombre de nuestra tabla/colección
-    connection=connection,                  # La URL de conexión (parámetro corregido)
-    pre_delete_collection=False,            # MUY IMPORTANTE: para no borrar la tabla al iniciar
-    async_mode=True
-)
+# Servidor alternativo (host:puerto) para los clientes de Gemini, p. ej. el
+# simulador de benchmarks/loadtest.
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+CLIENT_OPTIONS = {"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None
 
+@lru_cache(maxsize=1)
+def get_vector_store():
+    """
+    Conecta con el Vector Store existente en el primer uso.
+    Usamos PGVector.from_existing_index para esto.
+    """
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    from langchain_postgres.vectorstores import PGVector
+
+    # Modelo de Embeddings
+    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", client_options=CLIENT_OPTIONS)
+
+    return PGVector.from_existing_index(
+        embedding=embeddings,                   # El modelo de embeddings que usamos
+        collection_name=COLLECTION_NAME,        # El nombre de nuestra tabla/colección
+        connection=connection,                  # La URL de conexión (parámetro corregido)
+        pre_delete_collection=False,            # MUY IMPORTANTE: para no borrar la tabla al iniciar
+        async_mode=True
+    )
+
+# La inicialización perezosa de PGVector en async_mode no es segura con peticiones
+# concurrentes: la primera marca el store como listo antes de crear la colección
+# y las demás fallan con "Collection not found". Se hace una sola vez, en serie.
+_coleccion_lock = asyncio.Lock()
+_coleccion_lista = False
+
+async def asegurar_coleccion():
+    global _coleccion_lista
+    async with _coleccion_lock:
+        if not _coleccion_lista:
+            await get_vector_store().acreate_collection()
+            _coleccion_lista = True
+
+@lru_cache(maxsize=1)
 def setup_rag_chain():
     """
     Configura la cadena de RAG. Ahora es más simple:
     - Ya no carga archivos locales, solo se conecta al Vector Store.
+    - Se construye una sola vez, en la primera pregunta.
     """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
+
     # a. Modelo LLM (Gemini)
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.5)
+    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.5, client_options=CLIENT_OPTIONS)
 
     # b. Retriever (obtenido directamente de nuestro Vector Store persistente)
-    retriever = vector_store.as_retriever()
+    retriever = get_vector_store().as_retriever()
 
     # c. Prompt Template
     prompt = ChatPromptTemplate.from_template("""
@@ -97,9 +127,6 @@ def setup_rag_chain():
     
     return rag_chain
 
-# Creamos la cadena una sola vez al iniciar la aplicación
-rag_chain = setup_rag_chain()
-
 
 # -----------------------------------------------------------------------------
 # 3. DEFINICIÓN DE LA API (Endpoints)
@@ -118,6 +145,9 @@ async def subir_pdf(file: UploadFile = File(...)):
     """
     Este endpoint recibe un archivo PDF, lo procesa y lo almacena en la base de datos vectorial.
     """
+    from langchain_community.document_loaders import PyPDFLoader # <-- Cargador de PDFs
+    from app.services.chunking import LabReportSplitter
+
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="El archivo debe ser un PDF.")
 
@@ -132,12 +162,14 @@ async def subir_pdf(file: UploadFile = File(...)):
         docs = loader.load()
 
         # 2. Dividir el texto en chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+        text_splitter = LabReportSplitter(chunk_size=1000)
         splits = text_splitter.split_documents(docs)
 
         # 3. Añadir los chunks a la base de datos vectorial
         # PGVector se encargará de crear los embeddings y guardarlos
-        vector_store.add_documents(splits)
+        # (el store está en async_mode: los métodos síncronos fallan).
+        await asegurar_coleccion()
+        await get_vector_store().aadd_documents(splits)
 
     except Exception as e:
         # Si algo sale mal, lanzamos un error HTTP
@@ -156,7 +188,7 @@ async def preguntar(request: PreguntaRequest):
     Recibe una pregunta y la responde usando la información de los PDFs cargados.
     """
     try:
-        response = await rag_chain.ainvoke({"input": request.pregunta})
+        response = await setup_rag_chain().ainvoke({"input": request.pregunta})
         return {"respuesta": response["answer"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al procesar la pregunta: {e}")
\ No newline at end of file
@@ -0,0 +1,46 @@
+from app.services.chunking import LabReportSplitter
+
+ANALITOS = ["Glucosa", "Urea", "Creatinina", "Colesterol", "Triglicéridos",
+            "Hemoglobina", "Leucocitos", "Plaquetas", "Sodio", "Potasio"]
+
+
+def _pagina(numero, total, valores, membrete=True):
+    lineas = ["LABORATORIO CLÍNICO CENTRAL", "Tel. 0212 555 1234"] if membrete else []
+    lineas += [f"{analito} {valor} mg/dL" for analito, valor in valores]
+    lineas += [f"Página {numero} de {total}"]
+    return "\n".join(lineas)
+
+
+def _texto(chunks):
+    return "\n".join(texto for texto, _ in chunks)
+
+
+def test_conserva_valores_distintos_entre_paginas():
+    pagina1 = [(analito, 90 + i) for i, analito in enumerate(ANALITOS)]
+    pagina2 = [(analito, 130 + i) for i, analito in enumerate(ANALITOS)]
+    texto = _texto(LabReportSplitter().split_pages([_pagina(1, 2, pagina1), _pagina(2, 2, pagina2)]))
+
+    for analito, valor in pagina1 + pagina2:
+        assert f"{analito} {valor} mg/dL" in texto
+
+
+def test_descarta_numeracion_y_conserva_membrete_una_vez():
+    valores = [[(analito, 10 * p + i) for i, analito in enumerate(ANALITOS[:3])] for p in range(3)]
+    texto = _texto(LabReportSplitter().split_pages([_pagina(p + 1, 3, v) for p, v in enumerate(valores)]))
+
+    assert "Página" not in texto
+    assert texto.count("LABORATORIO CLÍNICO CENTRAL") == 1
+    assert texto.count("Tel. 0212 555 1234") == 1
+
+
+def test_panel_corto_conserva_todos_los_valores():
+    # Con tres filas por página todas caen en los márgenes de encabezado y pie.
+    paginas = [
+        "\n".join(f"{analito} {valor} mg/dL" for analito, valor in zip(ANALITOS[:3], (p, p + 10, p + 20)))
+        for p in (5, 6, 7)
+    ]
+    texto = _texto(LabReportSplitter().split_pages(paginas))
+
+    for p in (5, 6, 7):
+        for analito, valor in zip(ANALITOS[:3], (p, p + 10, p + 20)):
+            assert f"{analito} {valor} mg/dL" in texto
@@ -0,0 +1,43 @@
+from app.services.hybrid_search import HybridRetriever, vector_literal
+
+DIMENSION = 14
+CONSULTA = [1.0] + [0.0] * (DIMENSION - 1)
+
+
+def _base(i):
+    return [1.0 if j == i else 0.0 for j in range(DIMENSION)]
+
+
+def _fila(id_, vector, score):
+    return {"id": id_, "document": id_, "cmetadata": {}, "embedding": vector_literal(vector), "score": score}
+
+
+# Doce chunks parecidos a la consulta (coseno 0.8) y algo parecidos entre sí
+# (0.64), y uno solo léxico ("HbA1c") ortogonal a la consulta y a todos ellos.
+VECTORIALES = [_fila(f"v{i}", [0.8 * c + 0.6 * b for c, b in zip(CONSULTA, _base(i + 2))], 0.2)
+               for i in range(12)]
+HBA1C = _fila("hba1c", _base(1), 0.9)
+
+
+class _Embeddings:
+    def embed_query(self, texto):
+        return CONSULTA
+
+
+class _Retriever(HybridRetriever):
+    def _lexical(self, query, k, file_hashes=None):
+        return [HBA1C, VECTORIALES[0], VECTORIALES[1]]
+
+    def _vector(self, embedding, k, ids=None, file_hashes=None):
+        return VECTORIALES
+
+
+def test_mmr_conserva_resultado_solo_lexico():
+    retriever = _Retriever(collection_name="c", embeddings=_Embeddings(), engine=None, k=4, fetch_k=12,
+                           use_mmr=True)
+
+    ids = [doc.id for doc in retriever.invoke("HbA1c")]
+
+    assert len(ids) == 4
+    assert ids[0] == "v0"
+    assert "hba1c" in ids
@@ -0,0 +1,33 @@
+from app.api.utils.markdown import MarkdownRenderer, render_markdown
+
+
+def _incremental(texto, fragmento):
+    renderer = MarkdownRenderer()
+    partes = [renderer.feed(texto[i:i + fragmento]) for i in range(0, len(texto), fragmento)]
+    return "".join(partes) + renderer.close()
+
+
+def test_listas_anidadas_y_separador():
+    texto = "1. **Uno**\n    * a\n\n    * b\n2. Dos\n* * *\n- x\n- y\n"
+    esperado = ("<ol><li><strong>Uno</strong><ul><li>a</li><li>b</li></ul></li><li>Dos</li></ol><hr>"
+                "<ul><li>x</li><li>y</li></ul>")
+
+    assert render_markdown(texto) == esperado
+    for fragmento in (1, 5, 64):
+        assert _incremental(texto, fragmento) == esperado
+
+
+def test_tablas_con_y_sin_formato_regular():
+    texto = "| A | B |\n|---|---|\n| 1 | 2 |\n\n|a|  b |\n| c |\n"
+
+    assert render_markdown(texto) == (
+        '<table class="table table-sm"><thead><tr><th>A</th><th>B</th></tr></thead>'
+        "<tbody><tr><td>1</td><td>2</td></tr></tbody></table>"
+        '<table class="table table-sm"><tbody><tr><td>a</td><td>b</td></tr><tr><td>c</td></tr></tbody></table>'
+    )
+
+
+def test_titulos_y_parrafos():
+    texto = "## Resumen ##\ntexto <b>\n\notro\n#### Detalle\n"
+
+    assert render_markdown(texto) == "<h3>Resumen</h3><p>texto &lt;b&gt;</p><p>otro</p><h4>Detalle</h4>"
@@ -0,0 +1,23 @@
+from app.services import near_duplicates
+from app.services.near_duplicates import NearDuplicateIndex
+
+TEXTO = "Glucosa 95 mg/dL Colesterol total 180 mg/dL Triglicéridos 120 mg/dL Hemoglobina 14 g/dL"
+
+
+def test_sync_carga_reporte_de_id_menor_confirmado_despues():
+    firma = near_duplicates.minhash(TEXTO)
+    guardados = {}
+
+    def cargar(user_id, after_id):
+        return sorted((report_id, datos) for report_id, datos in guardados.items() if report_id > after_id)
+
+    indice = NearDuplicateIndex()
+    indice.sync(1, cargar)
+    # Este worker guarda el reporte 10 mientras otro aún no confirma el 5.
+    indice.add(1, 10, near_duplicates.minhash("otro texto sin relación con el anterior " * 3))
+    guardados[10] = b""
+    indice.sync(1, cargar)
+    guardados[5] = near_duplicates.to_bytes(firma)
+    indice.sync(1, cargar)
+
+    assert indice.query(1, firma, near_duplicates.THRESHOLD) == (5, 1.0)
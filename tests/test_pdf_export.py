@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import pytest
+
+from app.services import pdf_export
+
+DIA = 86400
+AHORA = 100 * DIA
+
+
+@pytest.fixture
+def directorio(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_export, "EXPORT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _archivo(directorio, nombre, tamano, dias):
+    ruta = directorio / nombre
+    ruta.write_bytes(b"x" * tamano)
+    os.utime(ruta, (AHORA - dias * DIA, AHORA - dias * DIA))
+    return ruta
+
+
+def test_limpiar_borra_los_archivos_sin_usar(directorio, monkeypatch):
+    monkeypatch.setattr(pdf_export, "EXPORT_MAX_AGE_DAYS", 30)
+    _archivo(directorio, "viejo.pdf", 10, 31)
+    _archivo(directorio, "reciente.json", 10, 29)
+
+    assert pdf_export.limpiar(AHORA) == 1
+    assert sorted(os.listdir(directorio)) == ["reciente.json"]
+
+
+def test_limpiar_borra_los_usados_hace_mas_tiempo_si_supera_el_tamano(directorio, monkeypatch):
+    monkeypatch.setattr(pdf_export, "EXPORT_MAX_MB", 2.5 / 1024)
+    for i in range(4):
+        _archivo(directorio, f"{i}.pdf", 1024, 4 - i)
+
+    assert pdf_export.limpiar(AHORA) == 2
+    assert sorted(os.listdir(directorio)) == ["2.pdf", "3.pdf"]
+
+
+def test_cargar_fuente_lo_protege_de_la_limpieza(directorio, monkeypatch):
+    monkeypatch.setattr(pdf_export, "EXPORT_MAX_AGE_DAYS", 30)
+    ver = pdf_export.guardar_fuente("informe-general", 1, "<p>hola</p>", "Informe", "")
+    ruta = pdf_export._ruta("informe-general", 1, ver, "json")
+    os.utime(ruta, (0, 0))
+
+    assert pdf_export.cargar_fuente("informe-general", 1, ver)["html"] == "<p>hola</p>"
+    assert pdf_export.limpiar() == 0
+    assert os.path.exists(ruta)
+
+
+def test_export_pdf_reintenta_si_el_lider_se_cancela(directorio, monkeypatch):
+    llamadas = []
+
+    async def generar(ruta, contenido_html, titulo, subtitulo):
+        llamadas.append(ruta)
+        if len(llamadas) == 1:
+            await asyncio.sleep(10)
+        pdf_export._escribir_atomico(ruta, b"%PDF-1.4")
+
+    monkeypatch.setattr(pdf_export, "_generar", generar)
+
+    async def escenario():
+        lider = asyncio.create_task(pdf_export.export_pdf("reporte", 1, "<p>hola</p>", "Reporte", ""))
+        await asyncio.sleep(0.05)
+        seguidor = asyncio.create_task(pdf_export.export_pdf("reporte", 1, "<p>hola</p>", "Reporte", ""))
+        await asyncio.sleep(0.05)
+        lider.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lider
+        return await seguidor
+
+    ruta, _ = asyncio.run(escenario())
+    assert len(llamadas) == 2
+    with open(ruta, "rb") as f:
+        assert f.read() == b"%PDF-1.4"
@@ -0,0 +1,156 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from google.genai import errors
+
+from app.api.utils import ia
+
+# Petición sin caché tal como la enviaba generate() antes de la caché de contexto.
+PETICION_BASE = json.loads((Path(__file__).parent / "data" / "peticion_sin_cache.json").read_text(encoding="utf-8"))
+
+
+def _error(codigo: int):
+    clase = errors.ClientError if codigo < 500 else errors.ServerError
+    return clase(codigo, httpx.Response(codigo, json={"error": {"code": codigo, "message": "prueba", "status": "X"}}))
+
+
+class _Cliente:
+    """Imita client.files, client.caches y client.models de google-genai."""
+
+    def __init__(self, errores_creacion=(), caches_expiradas=(), codigo_expirada=404):
+        self.errores_creacion = list(errores_creacion)
+        self.caches_expiradas = set(caches_expiradas)
+        self.codigo_expirada = codigo_expirada
+        self.intentos_creacion = 0
+        self.creadas = []
+        self.renovadas = []
+        self.peticiones = []
+        self.files = SimpleNamespace(
+            upload=lambda file: SimpleNamespace(uri="files/prueba", mime_type="application/pdf")
+        )
+        self.caches = SimpleNamespace(create=self._crear, update=self._renovar)
+        self.models = SimpleNamespace(generate_content=self._generar)
+
+    def _crear(self, model, config):
+        self.intentos_creacion += 1
+        if self.errores_creacion:
+            raise self.errores_creacion.pop(0)
+        self.creadas.append((model, config))
+        return SimpleNamespace(name=f"cachedContents/{len(self.creadas)}")
+
+    def _renovar(self, name, config):
+        self.renovadas.append((name, config.ttl))
+
+    def _generar(self, model, contents, config):
+        self.peticiones.append({
+            "model": model,
+            "contents": [c.model_dump(mode="json", exclude_none=True) for c in contents],
+            "config": config.model_dump(mode="json", exclude_none=True),
+        })
+        if config.cached_content in self.caches_expiradas:
+            raise _error(self.codigo_expirada)
+        return SimpleNamespace(text="análisis")
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(ia, "time", SimpleNamespace(time=lambda: ahora[0]))
+    return ahora
+
+
+@pytest.fixture
+def generar(monkeypatch, tmp_path, reloj):
+    """generate() con un cliente falso y una PromptCache nueva; la caché se activa con cualquier prefijo."""
+    pdf = tmp_path / "examen.pdf"
+    pdf.write_bytes(b"%PDF-1.4")
+    monkeypatch.setattr(ia, "CONTEXT_CACHE_ENABLED", True)
+    monkeypatch.setattr(ia, "CACHE_MIN_TOKENS", 0)
+    monkeypatch.setattr(ia, "prompt_cache", ia.PromptCache())
+
+    def generar(cliente):
+        monkeypatch.setattr(ia, "get_client", lambda: cliente)
+        return ia.generate(str(pdf))
+
+    return generar
+
+
+def test_prefijo_bajo_el_minimo_envia_la_peticion_original(generar, monkeypatch):
+    monkeypatch.setattr(ia, "CACHE_MIN_TOKENS", 32768)
+    cliente = _Cliente()
+
+    assert generar(cliente) == "análisis"
+    assert generar(cliente) == "análisis"
+    assert cliente.intentos_creacion == 0
+    assert cliente.peticiones == [PETICION_BASE, PETICION_BASE]
+
+
+def test_crea_la_cache_y_solo_envia_el_documento(generar):
+    cliente = _Cliente()
+
+    generar(cliente)
+    generar(cliente)
+
+    assert len(cliente.creadas) == 1
+    modelo, config = cliente.creadas[0]
+    assert modelo == ia.CACHE_MODEL
+    assert config.contents == ia.contenido_estatico()
+    for peticion in cliente.peticiones:
+        assert peticion["model"] == ia.CACHE_MODEL
+        assert peticion["config"]["cached_content"] == "cachedContents/1"
+        assert peticion["contents"] == PETICION_BASE["contents"][-1:]
+
+
+def test_renueva_el_ttl_antes_de_expirar(reloj, monkeypatch):
+    monkeypatch.setattr(ia, "CACHE_MIN_TOKENS", 0)
+    cache = ia.PromptCache(ttl=1000, renew_margin=100)
+    cliente = _Cliente()
+
+    assert cache.get_name(cliente) == "cachedContents/1"
+    reloj[0] += 850
+    assert cache.get_name(cliente) == "cachedContents/1"
+    assert cliente.renovadas == []
+    # Dentro del margen de renovación: se extiende el TTL de la misma caché.
+    reloj[0] += 100
+    assert cache.get_name(cliente) == "cachedContents/1"
+    assert cliente.renovadas == [("cachedContents/1", "1000s")]
+    # Ya expirada: se crea otra.
+    reloj[0] += 1001
+    assert cache.get_name(cliente) == "cachedContents/2"
+    assert len(cliente.renovadas) == 1
+
+
+@pytest.mark.parametrize("codigo", [403, 404])
+def test_cache_no_disponible_se_invalida_y_se_recrea(generar, codigo):
+    cliente = _Cliente(caches_expiradas={"cachedContents/1"}, codigo_expirada=codigo)
+
+    assert generar(cliente) == "análisis"
+    assert len(cliente.creadas) == 2
+    assert [p["config"]["cached_content"] for p in cliente.peticiones] == ["cachedContents/1", "cachedContents/2"]
+
+
+def test_error_400_deshabilita_la_cache(generar):
+    cliente = _Cliente(errores_creacion=[_error(400)])
+
+    generar(cliente)
+    generar(cliente)
+
+    assert cliente.intentos_creacion == 1
+    assert cliente.peticiones == [PETICION_BASE, PETICION_BASE]
+
+
+def test_otro_error_reintenta_tras_retry_after(generar, reloj):
+    cliente = _Cliente(errores_creacion=[_error(503)])
+
+    generar(cliente)
+    generar(cliente)
+    assert cliente.intentos_creacion == 1
+    assert cliente.peticiones == [PETICION_BASE, PETICION_BASE]
+
+    reloj[0] += ia.prompt_cache.retry_after
+    generar(cliente)
+    assert cliente.intentos_creacion == 2
+    assert cliente.peticiones[-1]["config"]["cached_content"] == "cachedContents/1"
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from app.services.single_flight import LiderCancelado, SingleFlight
+
+
+def test_comparte_el_resultado_del_lider():
+    async def escenario():
+        vuelo = SingleFlight()
+        llamadas = []
+
+        async def trabajo():
+            llamadas.append(1)
+            await asyncio.sleep(0.01)
+            return 42
+
+        return await asyncio.gather(vuelo.do("a", trabajo), vuelo.do("a", trabajo)), llamadas
+
+    resultados, llamadas = asyncio.run(escenario())
+    assert resultados == [(42, False), (42, True)]
+    assert len(llamadas) == 1
+
+
+def test_seguidor_recibe_error_si_el_lider_se_cancela():
+    async def escenario():
+        vuelo = SingleFlight()
+
+        async def trabajo():
+            await asyncio.sleep(10)
+
+        lider = asyncio.create_task(vuelo.do("a", trabajo))
+        await asyncio.sleep(0)
+        seguidor = asyncio.create_task(vuelo.do("a", trabajo))
+        await asyncio.sleep(0)
+        lider.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await lider
+        with pytest.raises(LiderCancelado):
+            await seguidor
+        assert not seguidor.cancelled()
+
+    asyncio.run(escenario())